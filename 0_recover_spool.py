@@ -0,0 +1,44 @@
+import argparse
+from pathlib import Path
+
+from embld.acquisition.recovery import find_spools, recover_spool
+from embld.acquisition.spool import SPOOL_DIRECTORY
+
+parser = argparse.ArgumentParser(
+    description="Recovery: Rebuild the c3d, mp3 and annotation files of trials interrupted by a crash from their acquisition spools"
+)
+parser.add_argument(
+    "--input",
+    type=str,
+    help=f"Path to the recordings directory, every *.spool file below it (usually in {SPOOL_DIRECTORY}/) is recovered",
+    required=True,
+)
+
+parser.add_argument(
+    "--output",
+    type=str,
+    help="Path to the output directory, defaults to the input directory",
+    required=False,
+)
+
+parser.add_argument(
+    "--keep",
+    action="store_true",
+    help="Keep the spool files after a successful recovery",
+)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    output = Path(args.output if args.output is not None else args.input)
+
+    spools = find_spools(args.input)
+    failed = 0
+    for spool in spools:
+        try:
+            target_path = recover_spool(spool, output, remove=not args.keep)
+            print(f"{spool.name} -> {target_path}")
+        except Exception as e:
+            failed += 1
+            print(f"Could not recover {spool}: {e}")
+    print(f"{len(spools) - failed}/{len(spools)} spools recovered into {output}")
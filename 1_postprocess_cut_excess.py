@@ -1,10 +1,18 @@
 import argparse
 import json
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 
-import tqdm
+from tqdm import tqdm
 
-from embld.postprocessing.io import recurse_downwards_input_hierarchy
+from embld.postprocessing.io import (
+    read_sync_sidecar,
+    recurse_downwards_input_hierarchy,
+    segment_file_name,
+)
+from embld.postprocessing.manifest import RazorManifest, file_fingerprint
 from embld.postprocessing.razor import (
     DispatchingRazor,
     FNIRSRecordingRazor,
@@ -26,32 +34,120 @@ parser.add_argument(
     "--output",
     type=str,
     help="Path to the output directory. The same structure as the input will be kept for the output",
+    required=True,
 )
 
+parser.add_argument(
+    "--jobs",
+    type=int,
+    default=1,
+    help="Number of worker processes cutting files in parallel (default: 1, no pool)",
+)
 
-def create_razor():
-    return razor
-
+parser.add_argument(
+    "--restart",
+    action="store_true",
+    help="Ignore the manifest of previous runs and cut every file again, even unchanged ones",
+)
 
-if __name__ == "__main__":
-    args = parser.parse_args()
+parser.add_argument(
+    "--split",
+    action="store_true",
+    help="Write one file per annotated segment (between two consecutive syncs) instead of only cutting the excess before the first sync",
+)
 
-    input_path = Path(args.input[0])
-    output_directory = Path(args.output[0])
+MANIFEST_NAME = "razor_manifest.jsonl"
 
-    input_directories = recurse_downwards_input_hierarchy(input_path)
 
-    razor = DispatchingRazor()
+def create_razor(split=False):
+    razor = DispatchingRazor(split=split)
     razor.add_razors(
         [MocapRecordingRazor(), FNIRSRecordingRazor(), SoundRecordingRazor()]
     )
+    return razor
 
-    for directory in tqdm(input_directories, desc="Razor-cutting input directories"):
-        annotation_files = list(directory.glob("*.json"))
-        for annotation_file in annotation_files:
+
+def collect_work_items(input_path: Path, output_directory: Path, formats):
+    items = []
+    for directory in recurse_downwards_input_hierarchy(input_path):
+        target_directory = output_directory / directory.relative_to(input_path)
+        for annotation_file in sorted(directory.glob("*_annotation.json")):
             metadata = json.load(annotation_file.open())
             segment_timings = [segment["onset"] for segment in metadata["segments"]]
-            file_basename = annotation_file.file.suffix[0]
-            data_files = list(directory.glob(f"{file_basename}*"))
-            razor(data_files, output_directory, segment_timings)
+            file_basename = annotation_file.name[: -len("_annotation.json")]
+            data_files = sorted(directory.glob(f"{file_basename}_*"))
+            # fNIRS recordings used to be saved as <trial>-raw.fif one level up
+            if directory != input_path:
+                data_files += sorted(directory.parent.glob(f"{file_basename}-*"))
+            for data_file in data_files:
+                if data_file.suffix[1:] in formats:
+                    sync = read_sync_sidecar(data_file)
+                    segment_indices = (
+                        sync["segment_sample_indices"] if sync is not None else None
+                    )
+                    items.append(
+                        (data_file, target_directory, segment_timings, segment_indices)
+                    )
+    return items
+
+
+def cut_file(item, split=False):
+    data_file, target_directory, segment_timings, segment_indices = item
+    try:
+        target_directory.mkdir(parents=True, exist_ok=True)
+        create_razor(split)(
+            data_file, target_directory, segment_timings, segment_indices
+        )
+        return None, file_fingerprint(data_file)
+    except Exception:
+        return traceback.format_exc(), None
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    input_path = Path(args.input)
+    output_directory = Path(args.output)
+
+    manifest_path = output_directory / MANIFEST_NAME
+    if args.restart and manifest_path.exists():
+        manifest_path.unlink()
+    manifest = RazorManifest(manifest_path)
+
+    formats = {f for fs in create_razor().handles_formats() for f in fs}
+    items = collect_work_items(input_path, output_directory, formats)
+    pending = [
+        item
+        for item in items
+        if not manifest.is_up_to_date(
+            str(item[0].relative_to(input_path)),
+            item[0],
+            item[2],
+            item[3],
+            item[1] / (segment_file_name(item[0], 0) if args.split else item[0].name),
+        )
+    ]
+    print(f"{len(items) - len(pending)} of {len(items)} files up to date, skipping")
+
+    if args.jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+        results = executor.map(partial(cut_file, split=args.split), pending)
+    else:
+        executor = None
+        results = map(partial(cut_file, split=args.split), pending)
+
+    failures = 0
+    for item, (error, fingerprint) in tqdm(
+        zip(pending, results), total=len(pending), desc="Razor-cutting recordings"
+    ):
+        key = str(item[0].relative_to(input_path))
+        if error is None:
+            manifest.record_cut(key, item[0], item[2], item[3], fingerprint)
+        else:
+            failures += 1
+            manifest.record(key, "failed", error=error)
+            tqdm.write(f"Failed to cut {key}:\n{error}")
 
+    if executor is not None:
+        executor.shutdown()
+    print(f"Done, {failures} failures (see {str(manifest_path)})")
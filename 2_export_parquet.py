@@ -0,0 +1,37 @@
+import argparse
+from pathlib import Path
+
+from embld.postprocessing.export import export_mocap_dataset
+
+parser = argparse.ArgumentParser(
+    description="Export: Write the mocap trials of a recordings directory as a partitioned Parquet dataset with a trial index"
+)
+parser.add_argument(
+    "--input",
+    type=str,
+    help="Path to the input directory. Every *_mocap.c3d below it is exported along with its *_annotation.json, body parts are looked up in the *-actions_sampled.json files found below it.",
+    required=True,
+)
+
+parser.add_argument(
+    "--output",
+    type=str,
+    help="Path to the output directory, partitioned as subject=/session=/action=/ with index.parquet at its root",
+    required=True,
+)
+
+parser.add_argument(
+    "--row-group-size",
+    type=int,
+    default=1 << 16,
+    help="Maximum number of rows per Parquet row group",
+)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    exported = export_mocap_dataset(
+        Path(args.input), Path(args.output), row_group_size=args.row_group_size
+    )
+    print(f"{exported} trials exported to {args.output}")
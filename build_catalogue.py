@@ -0,0 +1,66 @@
+import argparse
+import json
+
+from embld.configuration import APP_PARAMETERS
+from embld.experiment.catalogue import (
+    ConfigurationCatalogue,
+    build_catalogue,
+    catalogue_hash,
+    catalogue_path,
+)
+from embld.experiment.configuration_space import ConfigurationSpace
+
+parser = argparse.ArgumentParser(
+    description="Build the configuration catalogue of config.json once, sessions then load it instead of expanding the configurations"
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="Rebuild the catalogue even if one already matches config.json",
+)
+
+parser.add_argument(
+    "--export",
+    type=str,
+    default=None,
+    help="Also write every configuration of the catalogue to this JSON file",
+)
+
+parser.add_argument(
+    "--resolve",
+    type=str,
+    default=None,
+    help="Path to a *-actions_index.json file of a session, prints the configurations it sampled",
+)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    digest = catalogue_hash(APP_PARAMETERS)
+    path = catalogue_path(APP_PARAMETERS, digest)
+
+    if args.force or not path.exists():
+        space = ConfigurationSpace.from_actions(APP_PARAMETERS["actions"])
+        build_catalogue(space, path, digest)
+    with ConfigurationCatalogue(path) as catalogue:
+        print(f"{len(catalogue)} configurations in {path}")
+
+        if args.export is not None:
+            with open(args.export, "w") as fp:
+                json.dump(list(catalogue), fp, indent=4)
+            print(f"Configurations exported to {args.export}")
+
+    if args.resolve is not None:
+        with open(args.resolve, "r") as fp:
+            index = json.load(fp)
+        # Sessions refer to the catalogue of the config.json they were run with
+        with ConfigurationCatalogue(
+            catalogue_path(APP_PARAMETERS, index["catalogue"])
+        ) as catalogue:
+            for position, (configuration_index, rand_values) in enumerate(
+                zip(index["indices"], index["rand_values"])
+            ):
+                configuration = catalogue.configuration(
+                    configuration_index, rand_values
+                )
+                print(f"{position + 1}: {configuration['instruction']}")
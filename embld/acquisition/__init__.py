@@ -1 +1 @@
-from .recorder import TrialRecorder
\ No newline at end of file
+from embld.acquisition.recorder import TrialRecorder
@@ -21,30 +21,61 @@ def _add_annotations_to_raw(
 class ArtinisFNIRSRecorder(TrialRecorder):
     def start_acquisition(self):
         self.lsl_client.start()
+        self.samples_acquired = 0
+        self.stream_started = False
 
     def end_acquisition(self):
         self.lsl_client.stop()
 
+    def _append_to_backend(self, trial_key, raw):
+        if not self.stream_started:
+            self.output_backend.begin_trial(
+                trial_key,
+                "fnirs",
+                len(raw.ch_names),
+                "float64",
+                raw.info["sfreq"],
+                {"channels": raw.ch_names},
+            )
+            self.stream_started = True
+        self.output_backend.append(trial_key, "fnirs", raw.get_data().T)
+
     def acquire(self, num_samples):
+        trial_key = self.trial_key()
         raws = []
-        while not self.next_segment:
-            raws.append(self.lsl_client.get_data_as_raw(25))
+        while not self.segment_boundary.reached():
+            raw = self.lsl_client.get_data_as_raw(num_samples)
+            self.samples_acquired += len(raw.times)
+            if self.output_backend.streaming:
+                self._append_to_backend(trial_key, raw)
+                self.sampling_rate = raw.info["sfreq"]
+            else:
+                raws.append(raw)
+        # mne_realtime does not expose the LSL timestamps, boundaries are chunk aligned
+        self.mark_segment_boundary(self.samples_acquired)
         return raws
 
-    def coalesce_and_save(self, raws):
+    def coalesce_and_save(self, raws, trial):
+        if self.output_backend.streaming:
+            self.store_sync("fnirs", trial, self.sampling_rate)
+            return
         print("Merging raws...")
         merged_raw = concatenate_raws(raws)  # type: Raw
         _add_annotations_to_raw(
             merged_raw,
-            self.annotation_onsets,
-            self.annotation_durations,
-            self.annotation_descriptions,
+            trial["annotation_onsets"],
+            trial["annotation_durations"],
+            trial["annotation_descriptions"],
         )
         subject_str = subject_string_trial(
-            self.metadata, self.trial_number, self.current_trial_id
+            self.metadata, trial["trial_number"], trial["trial_id"]
+        )
+        # Next to the annotation, where the razor looks for the trial's recordings
+        target_path = Path(
+            self.base_output_path, "recordings", f"{subject_str}_fnirs-raw.fif"
         )
-        target_path = Path(self.base_output_path, f"{subject_str}-raw.fif")
         merged_raw.save(str(target_path))
+        self.save_sync(target_path, trial, merged_raw.info["sfreq"])
         print(f"Signals saved under {str(target_path)}")
 
     def __init__(
@@ -54,10 +85,14 @@ class ArtinisFNIRSRecorder(TrialRecorder):
         stream_type="NIRS",
         trial_segments: int = 2,
         base_output_path=".",
+        output_backend=None,
     ):
         super(ArtinisFNIRSRecorder, self).__init__(
-            metadata, trial_segments, base_output_path
+            metadata, trial_segments, base_output_path, output_backend=output_backend
         )
+        self.samples_acquired = 0
+        self.stream_started = False
+        self.sampling_rate = None
         self.lsl_client = LSLClient(
             host=stream_host, stream_type=stream_type, buffer_size=0
         )
@@ -3,82 +3,133 @@ from pathlib import Path
 
 import ezc3d
 import numpy as np
-from pylsl import pylsl
-import pydub
 
 
 from embld.acquisition import TrialRecorder
+from embld.acquisition.audio_writer import StreamingWavWriter, transcode_to_mp3
+from embld.acquisition.buffer import SampleBuffer, lsl_dtype
+from embld.acquisition.lsl import PersistentInlet, TimestampWindow
 from embld.experiment.utils import subject_string_trial
+from embld.postprocessing.mp3 import encoder_delay as mp3_encoder_delay
 
-
-def _start_lsl_client(stream_name, stream_type, buffer_size):
-    streams = pylsl.resolve_streams(wait_time=min(0.1, 10))
-    ids = []
-    for stream_info in streams:
-        ids.append(stream_info.source_id())
-        print(stream_info.as_xml())
-        if stream_info.name() == stream_name and stream_info.type() == stream_type:
-            break
-    else:
-        raise RuntimeError(f"{stream_name} not found in streams: {ids}")
-    print(
-        f"Found Microphone stream {repr(stream_info.name())} via "
-        f"{stream_info.source_id()}..."
-    )
-    return pylsl.StreamInlet(info=stream_info, max_buflen=buffer_size)
-
-
-def _write_audio(file_handle, sampling_frequency, array, normalized=False):
-    """numpy array to MP3"""
-    channels = 2 if (array.ndim == 2 and array.shape[1] == 2) else 1
-    y = np.int16(array * 2 ** 15) if normalized else np.int16(array)
-    song = pydub.AudioSegment(
-        y.tobytes(), frame_rate=sampling_frequency, sample_width=2, channels=channels
-    )
-    song.export(file_handle, format="mp3", bitrate="320k")
+_CHUNK_SECONDS = 0.1
 
 
 class AudioRecorder(TrialRecorder):
     def get_info(self):
-        lsl_info = self.client.info()
+        lsl_info = self.stream.info
         self.sampling_rate = lsl_info.nominal_srate()
-        print(lsl_info.as_xml())
+        return lsl_info
 
     def start_acquisition(self):
-        self.client = _start_lsl_client(
-            self.stream_host, self.stream_type, self.buffer_size
+        self.client = self.stream.open()
+        if self.buffer is None:
+            self.get_info()
+            self._allocate_buffer()
+        self.first_timestamp = None
+        self.frames_acquired = 0
+        self.timestamp_window.clear()
+        self.output_backend.begin_trial(
+            self.trial_key(),
+            "audio",
+            self.buffer.data.shape[1],
+            self.buffer.data.dtype,
+            self.sampling_rate,
+        )
+        self.open_spool(
+            "audio",
+            self.buffer.data.shape[1],
+            self.buffer.data.dtype,
+            sampling_rate=self.sampling_rate,
+            output_format=self.output_format,
+        )
+        if self.output_backend.streaming:
+            self.writer = None
+            return
+        self.writer = StreamingWavWriter(
+            self._target_path(".wav"),
+            self.buffer.data.shape[1],
+            self.sampling_rate,
+            normalized=False,
         )
-        self.get_info()
 
     def end_acquisition(self):
-        self.client.close_stream()
-
-    def acquire(self, num_samples):
-        raws = []
-        while not self.next_segment:
-            wait_time = 25 * 5.0 / 50
-            samples, _ = self.client.pull_chunk(
-                max_samples=num_samples, timeout=wait_time
-            )
-            data = np.vstack(samples).T
-            # print(data)
-            raws.append(data)
-        return raws
-
-    def coalesce_and_save(self, raws):
-        merged_raw = np.concatenate(raws, 1).swapaxes(0, 1)
-        print(merged_raw.shape)
-        # sampling_rate = self.get_info().nominal_srate()
-        merged_raw = np.nan_to_num(merged_raw, nan=0.0)
+        if self.writer is not None:
+            self.writer.close()
+        print(f"{self.frames_acquired} audio frames written")
+
+    def close_session(self):
+        self.stream.close()
+
+    def _allocate_buffer(self):
+        info = self.stream.info
+        self.chunk_size = max(1, int(self.sampling_rate * _CHUNK_SECONDS))
+        self.buffer = SampleBuffer(
+            info.channel_count(), dtype=lsl_dtype(info), capacity=self.chunk_size
+        )
 
+    def _target_path(self, suffix):
         subject_str = subject_string_trial(
             self.metadata, self.trial_number, self.current_trial_id
         )
-        target_path_audio = Path(
-            self.base_output_path, "recordings", f"{subject_str}_audio.mp3"
+        return Path(self.base_output_path, "recordings", f"{subject_str}_audio{suffix}")
+
+    def acquire(self, num_samples):
+        # Audio rates make per-sample lists prohibitive, pull whole blocks instead
+        # and hand them to the wav writer so memory stays at one block per trial
+        trial_key = self.trial_key()
+        while not self.segment_boundary.reached():
+            chunk, timestamps = self.buffer.pull_chunk(
+                self.client,
+                max_samples=self.chunk_size,
+                timeout=_CHUNK_SECONDS * 2,
+                time_correction=self.stream.time_correction,
+            )
+            if self.frames_acquired == 0 and len(timestamps) > 0:
+                self.first_timestamp = float(timestamps[0])
+            if self.writer is not None:
+                self.writer.write(chunk)
+            # Per-sample timestamps would outweigh the samples, only the first is kept
+            self.output_backend.append(trial_key, "audio", chunk)
+            if self.spool is not None:
+                self.spool.append(chunk, timestamps)
+            self.frames_acquired += len(chunk)
+            self.timestamp_window.append(timestamps)
+            self.buffer.clear()
+        _, boundary_lsl_time = self.segment_boundary.current()
+        self.mark_segment_boundary(
+            self.timestamp_window.sample_index(boundary_lsl_time)
+        )
+        return []
+
+    def trial_data(self, raws):
+        if self.writer is None:
+            return None, self.first_timestamp
+        return self.writer.path, self.first_timestamp
+
+    def coalesce_and_save(self, raws, trial):
+        # The wav is complete once the acquisition ends, only the transcoding is left
+        target_path_audio, first_timestamp = raws
+        if target_path_audio is None:
+            self.store_sync(
+                "audio",
+                trial,
+                self.sampling_rate,
+                first_sample_lsl_time=first_timestamp,
+            )
+            return
+        encoder_delay = None
+        if self.output_format == "mp3":
+            target_path_audio = transcode_to_mp3(target_path_audio, bitrate="320k")
+            # The segment indices count wav samples, the mp3 decodes to more
+            encoder_delay = mp3_encoder_delay(target_path_audio)
+        self.save_sync(
+            target_path_audio,
+            trial,
+            self.sampling_rate,
+            first_sample_lsl_time=first_timestamp,
+            encoder_delay=encoder_delay,
         )
-        with open(target_path_audio, "wb") as f:
-            _write_audio(f, self.sampling_rate, merged_raw, normalized=False)
 
     def __init__(
         self,
@@ -89,16 +140,33 @@ class AudioRecorder(TrialRecorder):
         base_output_path=".",
         buffer_size=1000,
         sampling_rate=50,
+        output_format="mp3",
+        output_backend=None,
+        spool_fsync_interval=None,
     ):
-        super(AudioRecorder, self).__init__(metadata, trial_segments, base_output_path)
+        super(AudioRecorder, self).__init__(
+            metadata,
+            trial_segments,
+            base_output_path,
+            output_backend=output_backend,
+            spool_fsync_interval=spool_fsync_interval,
+        )
         self.unit = None
         self.client = None
         self.stream_host = stream_host
         self.stream_type = stream_type
         self.buffer_size = buffer_size
+        self.stream = PersistentInlet(stream_host, stream_type, buffer_size)
         self.sampling_rate = sampling_rate
         self.current_trial_label = None
         self.channels = None
+        self.buffer = None
+        self.chunk_size = None
+        self.writer = None
+        self.first_timestamp = None
+        self.frames_acquired = 0
+        self.timestamp_window = TimestampWindow()
+        self.output_format = output_format
 
     def receive_label(self, label):
         self.current_trial_label = label
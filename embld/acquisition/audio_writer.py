@@ -0,0 +1,53 @@
+import logging
+import wave
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("Audio Writer")
+
+
+def _to_pcm16(block, normalized=False):
+    if np.issubdtype(block.dtype, np.floating):
+        block = np.nan_to_num(block, nan=0.0)
+        if normalized:
+            block = block * 2**15
+    return np.asarray(block, dtype="<i2")
+
+
+class StreamingWavWriter:
+    """Appends 16 bit PCM blocks to a wav file while the trial is recorded."""
+
+    def __init__(self, path, channels, sampling_rate, normalized=False):
+        self.path = Path(path)
+        self.normalized = normalized
+        self.frames_written = 0
+        self._file = wave.open(str(self.path), "wb")
+        self._file.setnchannels(channels)
+        self._file.setsampwidth(2)
+        self._file.setframerate(int(sampling_rate))
+
+    def write(self, block):
+        if len(block) == 0:
+            return
+        # writeframesraw leaves the header alone until close(), one patch per trial
+        self._file.writeframesraw(_to_pcm16(block, self.normalized).tobytes())
+        self.frames_written += len(block)
+
+    def close(self):
+        self._file.close()
+        return self.path
+
+
+def transcode_to_mp3(wav_path, bitrate="320k", remove_source=True):
+    import pydub
+
+    wav_path = Path(wav_path)
+    mp3_path = wav_path.with_suffix(".mp3")
+    pydub.AudioSegment.from_wav(wav_path).export(
+        mp3_path, format="mp3", bitrate=bitrate
+    )
+    if remove_source:
+        wav_path.unlink()
+    logger.info(f"Audio transcoded to {str(mp3_path)}")
+    return mp3_path
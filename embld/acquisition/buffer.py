@@ -0,0 +1,73 @@
+import numpy as np
+from pylsl import pylsl
+
+_LSL_DTYPES = {
+    pylsl.cf_float32: np.float32,
+    pylsl.cf_double64: np.float64,
+    pylsl.cf_int32: np.int32,
+    pylsl.cf_int16: np.int16,
+    pylsl.cf_int8: np.int8,
+}
+
+
+def lsl_dtype(info_structure):
+    return _LSL_DTYPES[info_structure.channel_format()]
+
+
+class SampleBuffer:
+    """Growable (capacity, channels) array that LSL inlets pull into in place.
+
+    Rows are laid out exactly as liblsl writes them (sample-major), so a chunk
+    can be pulled with ``dest_obj`` into the free tail of the array without any
+    intermediate Python list. The LSL timestamp of every row is kept alongside,
+    already mapped onto the local clock. Capacity doubles when the tail is too
+    short, and ``clear`` keeps the allocation for the next trial.
+    """
+
+    def __init__(self, channel_count, dtype=np.float32, capacity=1024):
+        self.data = np.empty((capacity, channel_count), dtype=dtype)
+        self.timestamps = np.empty(capacity)
+        self.length = 0
+
+    def clear(self):
+        self.length = 0
+
+    def reserve(self, num_samples):
+        required = self.length + num_samples
+        if required > len(self.data):
+            capacity = max(required, 2 * len(self.data))
+            data = np.empty((capacity, self.data.shape[1]), dtype=self.data.dtype)
+            data[: self.length] = self.data[: self.length]
+            timestamps = np.empty(capacity)
+            timestamps[: self.length] = self.timestamps[: self.length]
+            self.data = data
+            self.timestamps = timestamps
+        return self.data[self.length : required]
+
+    def pull_chunk(self, inlet, max_samples, timeout, time_correction=0.0):
+        dest = self.reserve(max_samples)
+        _, timestamps = inlet.pull_chunk(
+            timeout=timeout, max_samples=max_samples, dest_obj=dest
+        )
+        num_samples = len(timestamps)
+        chunk = dest[:num_samples]
+        chunk_timestamps = self.timestamps[self.length : self.length + num_samples]
+        chunk_timestamps[:] = timestamps
+        chunk_timestamps += time_correction
+        self.length += num_samples
+        return chunk, chunk_timestamps
+
+    def detach(self):
+        """Returns the filled samples and timestamps, continuing in a fresh allocation."""
+        samples = self.data[: self.length]
+        timestamps = self.timestamps[: self.length]
+        self.data = np.empty_like(self.data)
+        self.timestamps = np.empty_like(self.timestamps)
+        self.length = 0
+        return samples, timestamps
+
+    def view(self):
+        return self.data[: self.length]
+
+    def __len__(self):
+        return self.length
@@ -0,0 +1,112 @@
+import logging
+from collections import deque
+
+import numpy as np
+from pylsl import pylsl
+
+logger = logging.getLogger("LSL")
+
+_RESOLVE_WAIT_TIME = 0.1
+_OPEN_TIMEOUT = 10.0
+
+_resolved_streams = {}
+
+
+def resolve_stream_info(stream_name, stream_type):
+    key = (stream_name, stream_type)
+    if key not in _resolved_streams:
+        streams = pylsl.resolve_streams(wait_time=_RESOLVE_WAIT_TIME)
+        ids = []
+        for stream_info in streams:
+            ids.append(stream_info.source_id())
+            if stream_info.name() == stream_name and stream_info.type() == stream_type:
+                break
+        else:
+            raise RuntimeError(f"{stream_name} not found in streams: {ids}")
+        logger.info(
+            f"Found {stream_type} stream {repr(stream_info.name())} via "
+            f"{stream_info.source_id()}..."
+        )
+        _resolved_streams[key] = stream_info
+    return _resolved_streams[key]
+
+
+class TimestampWindow:
+    """Timestamps of the last chunks pulled from a stream, on the local LSL clock.
+
+    Transport latency can deliver the chunk holding a segment boundary before
+    the boundary is signalled, so the search spans the previous chunks too.
+    """
+
+    def __init__(self, chunks=8):
+        self.chunks = deque(maxlen=chunks)
+        self.samples = 0
+
+    def clear(self):
+        self.chunks.clear()
+        self.samples = 0
+
+    def append(self, timestamps):
+        if len(timestamps) > 0:
+            self.chunks.append((self.samples, np.asarray(timestamps)))
+        self.samples += len(timestamps)
+
+    def sample_index(self, boundary_time):
+        """Index of the first sample acquired after ``boundary_time``."""
+        for start, timestamps in self.chunks:
+            position = int(np.searchsorted(timestamps, boundary_time, side="right"))
+            if position < len(timestamps):
+                if position == 0 and start > 0 and start == self.chunks[0][0]:
+                    logger.warning(
+                        f"Segment boundary at {boundary_time} precedes the "
+                        f"{len(self.chunks)} chunks kept, clamped to sample {start}"
+                    )
+                return start + position
+        return self.samples
+
+
+def forget_stream_info(stream_name, stream_type):
+    _resolved_streams.pop((stream_name, stream_type), None)
+
+
+class PersistentInlet:
+    """Keeps one LSL inlet open for the whole session instead of one per trial.
+
+    ``open`` resolves and connects on first use and only flushes the samples
+    queued since the previous trial afterwards. ``info`` is the full stream
+    description fetched once at connection, so channel metadata can be parsed
+    a single time.
+    """
+
+    def __init__(self, stream_name, stream_type, buffer_size):
+        self.stream_name = stream_name
+        self.stream_type = stream_type
+        self.buffer_size = buffer_size
+        self.inlet = None
+        self.info = None
+        self.time_correction = 0.0
+
+    def open(self):
+        if self.inlet is None:
+            stream_info = resolve_stream_info(self.stream_name, self.stream_type)
+            try:
+                self.inlet = pylsl.StreamInlet(
+                    info=stream_info, max_buflen=self.buffer_size
+                )
+                self.inlet.open_stream(timeout=_OPEN_TIMEOUT)
+                self.info = self.inlet.info(timeout=_OPEN_TIMEOUT)
+            except Exception:
+                self.inlet = None
+                forget_stream_info(self.stream_name, self.stream_type)
+                raise
+            logger.debug(self.info.as_xml())
+        else:
+            dropped = self.inlet.flush()
+            logger.debug(f"{self.stream_name}: flushed {dropped} stale samples")
+        self.time_correction = self.inlet.time_correction(timeout=_OPEN_TIMEOUT)
+        return self.inlet
+
+    def close(self):
+        if self.inlet is not None:
+            self.inlet.close_stream()
+            self.inlet = None
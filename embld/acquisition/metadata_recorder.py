@@ -2,7 +2,6 @@ import json
 import logging
 from pathlib import Path
 import threading
-from time import sleep
 
 from embld.acquisition import TrialRecorder
 from embld.experiment.utils import subject_string_trial
@@ -18,6 +17,7 @@ def _write_metadata_and_annotations(
     annotation_onsets,
     annotation_durations,
     target_path,
+    segment_lsl_times=None,
 ):
     metadata = metadata.copy()
     metadata["trial_id"] = trial_id
@@ -27,6 +27,8 @@ def _write_metadata_and_annotations(
 
     for i in range(len(annotation_onsets)):
         mdict = {"position": i, "onset": annotation_onsets[i]}
+        if segment_lsl_times is not None and i < len(segment_lsl_times):
+            mdict["lsl_time"] = segment_lsl_times[i]
         if i > 0:
             mdict["duration"] = annotation_durations[i - 1]
         metadata["segments"].append(mdict)
@@ -37,40 +39,64 @@ def _write_metadata_and_annotations(
 class MetadataRecorder(TrialRecorder):
     def start_acquisition(self):
         logger.debug("Acquistion started for trial {self.trial_number}")
+        self.open_spool("annotation", metadata=self.metadata)
 
     def end_acquisition(self):
         logger.debug(f"Acquistion ended for trial {self.trial_number}")
         pass
 
     def acquire(self, num_samples):
-        while not self.next_segment:
-            sleep_time = int(num_samples / self.sampling_rate)
-            sleep(sleep_time)
+        self.segment_boundary.wait()
         return []
 
-    def coalesce_and_save(self, raws):
+    def coalesce_and_save(self, raws, trial):
         subject_str = subject_string_trial(
-            self.metadata, self.trial_number, self.current_trial_id
+            self.metadata, trial["trial_number"], trial["trial_id"]
         )
         target_path_meta = Path(
             self.base_output_path, "recordings", f"{subject_str}_annotation.json"
         )
         _write_metadata_and_annotations(
             self.metadata,
-            self.trial_number,
-            self.current_trial_id,
-            self.current_trial_label,
-            self.annotation_onsets,
-            self.annotation_durations,
+            trial["trial_number"],
+            trial["trial_id"],
+            trial["trial_label"],
+            trial["annotation_onsets"],
+            trial["annotation_durations"],
             str(target_path_meta),
+            segment_lsl_times=trial["segment_lsl_times"],
         )
         logger.info(f"Metadata saved under {str(target_path_meta)}")
+        # The annotation file stays the reference for postprocessing, streaming
+        # backends get a copy so the session file is self-describing
+        self.output_backend.annotate(
+            subject_str,
+            {
+                "trial_id": trial["trial_id"],
+                "trial_order": trial["trial_number"],
+                "instruction": trial["trial_label"],
+                "annotation_onsets": trial["annotation_onsets"],
+                "annotation_durations": trial["annotation_durations"],
+                "annotation_descriptions": trial["annotation_descriptions"],
+                "segment_lsl_times": trial["segment_lsl_times"],
+            },
+        )
 
     def __init__(
-        self, metadata, trial_segments: int = 2, base_output_path=".", sampling_rate=50
+        self,
+        metadata,
+        trial_segments: int = 2,
+        base_output_path=".",
+        sampling_rate=50,
+        output_backend=None,
+        spool_fsync_interval=None,
     ):
         super(MetadataRecorder, self).__init__(
-            metadata, trial_segments, base_output_path
+            metadata,
+            trial_segments,
+            base_output_path,
+            output_backend=output_backend,
+            spool_fsync_interval=spool_fsync_interval,
         )
         self.unit = None
         self.sampling_rate = sampling_rate
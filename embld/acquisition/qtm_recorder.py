@@ -3,27 +3,13 @@ from pathlib import Path
 
 import ezc3d
 import numpy as np
-from pylsl import pylsl
 
 from embld.acquisition import TrialRecorder
+from embld.acquisition.buffer import SampleBuffer, lsl_dtype
+from embld.acquisition.lsl import PersistentInlet, TimestampWindow
 from embld.experiment.utils import subject_string_trial
 
-
-def _start_lsl_client(stream_host, stream_type, buffer_size):
-    streams = pylsl.resolve_streams(wait_time=min(0.1, 10))
-    ids = []
-    for stream_info in streams:
-        ids.append(stream_info.source_id())
-        print(stream_info.as_xml())
-        if stream_info.name() == stream_host and stream_info.type() == stream_type:
-            break
-    else:
-        raise RuntimeError(f"{stream_host} not found in streams: {ids}")
-    print(
-        f"Found QTM stream {repr(stream_info.name())} via "
-        f"{stream_info.source_id()}..."
-    )
-    return pylsl.StreamInlet(info=stream_info, max_buflen=buffer_size)
+_INITIAL_BUFFER_SECONDS = 60
 
 
 def _extract_channels(info_structure):
@@ -43,68 +29,127 @@ def _extract_units(info_structure):
     return ch.child_value("unit")
 
 
+def _to_c3d_points(frames):
+    # LSL frames are (n, markers * 3), c3d expects (4, markers, n) homogeneous
+    frames = frames.reshape(len(frames), -1, 3)
+    points = np.ones((4, frames.shape[1], len(frames)))
+    points[:3] = frames.transpose(2, 1, 0)
+    return points
+
+
+def write_c3d(target_path, frames, channels, sampling_rate):
+    c3d = ezc3d.c3d()
+    c3d["data"]["points"] = _to_c3d_points(frames)
+    c3d["parameters"]["POINT"]["RATE"]["value"] = [sampling_rate]
+    c3d["parameters"]["POINT"]["LABELS"]["value"] = tuple(channels)
+    c3d["parameters"]["POINT"]["USED"]["value"] = [len(channels)]
+
+    # c3d.add_parameter("EVENT", "USED", {'type': 2, "value":[len(self.annotation_onsets)]})
+    # c3d.add_parameter("EVENT", "LABELS", tuple(self.annotation_descriptions))
+    # times_array = np.zeros(2, len(self.annotation_onsets))
+    # times_array[1] = np.array(self.annotation_onsets)
+    # c3d.add_parameter("EVENT", "TIMES", {'type': 4, 'value':times_array})
+    c3d.write(str(target_path))
+
+
 class QTMMocapRecorder(TrialRecorder):
     def get_info(self):
-        lsl_info = self.client.info()
+        lsl_info = self.stream.info
         print(lsl_info.as_xml())
 
     def start_acquisition(self):
-        self.client = _start_lsl_client(
-            self.stream_host, self.stream_type, self.buffer_size
+        self.client = self.stream.open()
+        if self.buffer is None:
+            self._allocate_buffer()
+        self.buffer.clear()
+        self.frames_acquired = 0
+        self.timestamp_window.clear()
+        # Frames are scaled to millimeters as they are acquired
+        unit = "millimeters" if self.unit == "meters" else self.unit
+        self.output_backend.begin_trial(
+            self.trial_key(),
+            "mocap",
+            self.buffer.data.shape[1],
+            self.buffer.data.dtype,
+            self.sampling_rate,
+            {"channels": self.channels, "unit": unit},
+        )
+        self.open_spool(
+            "mocap",
+            self.buffer.data.shape[1],
+            self.buffer.data.dtype,
+            sampling_rate=self.sampling_rate,
+            channels=self.channels,
+            unit=unit,
         )
 
     def end_acquisition(self):
-        self.client.close_stream()
+        pass
+
+    def close_session(self):
+        self.stream.close()
+
+    def _allocate_buffer(self):
+        info = self.stream.info
+        self.channels = _extract_channels(info)
+        self.unit = _extract_units(info)
+        self.buffer = SampleBuffer(
+            info.channel_count(),
+            dtype=lsl_dtype(info),
+            capacity=int(self.sampling_rate * _INITIAL_BUFFER_SECONDS),
+        )
 
     def acquire(self, num_samples):
-        raws = []
-        while not self.next_segment:
-            if self.channels is None:
-                self.channels = _extract_channels(self.client.info())
-                self.unit = _extract_units(self.client.info())
+        trial_key = self.trial_key()
+        multiplier = 1000.0 if self.unit == "meters" else 1.0
+        while not self.segment_boundary.reached():
             wait_time = 25 * 5.0 / 50
-            samples, _ = self.client.pull_chunk(
-                max_samples=num_samples, timeout=wait_time
+            chunk, timestamps = self.buffer.pull_chunk(
+                self.client,
+                max_samples=num_samples,
+                timeout=wait_time,
+                time_correction=self.stream.time_correction,
             )
-            multiplier = 1.0
-            if self.unit == "meters":
-                multiplier = 1000.0
-            data = np.vstack(samples).T
-            x_data = data[::3].copy() * multiplier
-            y_data = data[1::3].copy() * multiplier
-            z_data = data[2::3].copy() * multiplier
-            hom = np.ones(z_data.shape)
-            data = np.moveaxis(np.stack([x_data, y_data, z_data, hom], 2), 2, 0)
-            raws.append(data)
-        return raws
-
-    def coalesce_and_save(self, raws):
-        c3d = ezc3d.c3d()
-        print("Merging raws...")
-        merged_raw = np.concatenate(raws, 2)
-        c3d["data"]["points"] = merged_raw
+            if multiplier != 1.0:
+                chunk *= multiplier
+            self.frames_acquired += len(chunk)
+            self.timestamp_window.append(timestamps)
+            self.output_backend.append(trial_key, "mocap", chunk, timestamps)
+            if self.spool is not None:
+                self.spool.append(chunk, timestamps)
+            if self.output_backend.streaming:
+                # The samples are on disk already, keep only one chunk in memory
+                self.buffer.clear()
+        _, boundary_lsl_time = self.segment_boundary.current()
+        self.mark_segment_boundary(
+            self.timestamp_window.sample_index(boundary_lsl_time)
+        )
+        return []
+
+    def trial_data(self, raws):
+        if self.output_backend.streaming:
+            return None
+        # The spool is only read back to recover a trial after a crash
+        return self.buffer.detach()
+
+    def coalesce_and_save(self, raws, trial):
+        if self.output_backend.streaming:
+            self.store_sync("mocap", trial, self.sampling_rate)
+            return
+        frames, timestamps = raws
         print("SR", self.sampling_rate)
         print("Channels", len(self.channels))
-        print("Annotations", len(self.annotation_onsets))
-        print(self.annotation_descriptions)
-
-        c3d["parameters"]["POINT"]["RATE"]["value"] = [self.sampling_rate]
-        c3d["parameters"]["POINT"]["LABELS"]["value"] = tuple(self.channels)
-        c3d["parameters"]["POINT"]["USED"]["value"] = [len(self.channels)]
-
-        # c3d.add_parameter("EVENT", "USED", {'type': 2, "value":[len(self.annotation_onsets)]})
-        # c3d.add_parameter("EVENT", "LABELS", tuple(self.annotation_descriptions))
-        # times_array = np.zeros(2, len(self.annotation_onsets))
-        # times_array[1] = np.array(self.annotation_onsets)
-        # c3d.add_parameter("EVENT", "TIMES", {'type': 4, 'value':times_array})
+        print("Annotations", len(trial["annotation_onsets"]))
+        print(trial["annotation_descriptions"])
 
         subject_str = subject_string_trial(
-            self.metadata, self.trial_number, self.current_trial_id
+            self.metadata, trial["trial_number"], trial["trial_id"]
         )
         target_path_mocap = Path(
             self.base_output_path, "recordings", f"{subject_str}_mocap.c3d"
         )
-        c3d.write(str(target_path_mocap))
+        write_c3d(target_path_mocap, frames, self.channels, self.sampling_rate)
+        self.save_sync(target_path_mocap, trial, self.sampling_rate, timestamps)
 
     def __init__(
         self,
@@ -115,18 +160,28 @@ class QTMMocapRecorder(TrialRecorder):
         base_output_path=".",
         buffer_size=1000,
         sampling_rate=50,
+        output_backend=None,
+        spool_fsync_interval=None,
     ):
         super(QTMMocapRecorder, self).__init__(
-            metadata, trial_segments, base_output_path
+            metadata,
+            trial_segments,
+            base_output_path,
+            output_backend=output_backend,
+            spool_fsync_interval=spool_fsync_interval,
         )
         self.unit = None
         self.client = None
         self.stream_host = stream_host
         self.stream_type = stream_type
         self.buffer_size = buffer_size
+        self.stream = PersistentInlet(stream_host, stream_type, buffer_size)
         self.sampling_rate = sampling_rate
         self.current_trial_label = None
         self.channels = None
+        self.buffer = None
+        self.frames_acquired = 0
+        self.timestamp_window = TimestampWindow()
 
     def receive_label(self, label):
         self.current_trial_label = label
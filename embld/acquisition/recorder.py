@@ -1,3 +1,4 @@
+import json
 import logging
 import threading
 from abc import abstractmethod
@@ -5,23 +6,120 @@ from pathlib import Path
 
 from PyQt5.QtCore import QObject, QReadWriteLock, pyqtSignal
 import debugpy
+from pylsl import pylsl
 from tqdm import trange
 
+from embld.acquisition.spool import ChunkSpool, spool_path
+from embld.acquisition.storage import NativeOutputBackend
+from embld.acquisition.writer_pool import shared_writer_pool
+from embld.experiment.utils import subject_string_trial, sync_sidecar_path
 from util.timer import now_absolute
 
 logger = logging.getLogger("Recorder")
 
 
+def write_sync_sidecar(
+    data_path,
+    trial,
+    sampling_rate,
+    timestamps=None,
+    first_sample_lsl_time=None,
+    encoder_delay=None,
+):
+    """Writes the exact segment boundaries of a recording next to it.
+
+    Postprocessing cuts on ``segment_sample_indices`` when this sidecar
+    exists instead of converting the annotation onsets with the rate.
+    ``encoder_delay`` is the number of samples a lossy encoder prepended to
+    the recorded ones, which the indices do not account for.
+    """
+    sync = {
+        "sampling_rate": sampling_rate,
+        "trial_start_lsl_time": trial["trial_start_lsl_time"],
+        "segment_lsl_times": trial["segment_lsl_times"],
+        "segment_sample_indices": trial["segment_sample_indices"],
+    }
+    if timestamps is not None and len(timestamps) > 0:
+        first_sample_lsl_time = float(timestamps[0])
+        sync["timestamps"] = [float(timestamp) for timestamp in timestamps]
+    sync["first_sample_lsl_time"] = first_sample_lsl_time
+    if encoder_delay is not None:
+        sync["encoder_delay"] = encoder_delay
+    with open(sync_sidecar_path(data_path), "w") as fp:
+        json.dump(sync, fp)
+
+
+class SegmentBoundary:
+    """Segment boundaries signalled by the protocol, consumed by a recorder.
+
+    Every ``signal`` is timestamped both on the monotonic clock used for the
+    annotations and on the LSL clock, and is counted, so a sync arriving while
+    the recorder is still closing the previous segment is not lost.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._signalled = 0
+        self._consumed = 0
+        self.timestamps = []
+
+    def reset(self):
+        with self._condition:
+            self._signalled = 0
+            self._consumed = 0
+            self.timestamps.clear()
+
+    def signal(self, timestamp=None):
+        """Signals a boundary at ``timestamp``, a (now_absolute, LSL clock)
+        pair taken now if None, and returns it."""
+        with self._condition:
+            if timestamp is None:
+                timestamp = (now_absolute(), pylsl.local_clock())
+            self.timestamps.append(timestamp)
+            self._signalled += 1
+            self._condition.notify_all()
+        return timestamp
+
+    def reached(self):
+        with self._condition:
+            return self._signalled > self._consumed
+
+    def wait(self, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._signalled > self._consumed, timeout=timeout
+            )
+
+    def current(self):
+        """Timestamps of the boundary ending the segment being acquired."""
+        with self._condition:
+            return self.timestamps[self._consumed]
+
+    def consume(self):
+        with self._condition:
+            self._consumed += 1
+
+
 class TrialRecorder(QObject):
     ready_for_next_signal = pyqtSignal()
+    trial_saved_signal = pyqtSignal(int)
 
-    def __init__(self, metadata, trial_segments: int = 2, base_output_path="."):
+    def __init__(
+        self,
+        metadata,
+        trial_segments: int = 2,
+        base_output_path=".",
+        writer_pool=None,
+        output_backend=None,
+        spool_fsync_interval=None,
+    ):
         super(TrialRecorder, self).__init__()
         self.ongoing_start_time = None
         self.trial_start_event = None
         self.terminated = False
         self.trial_segments = trial_segments
         self.current_trial_id = ""
+        self.current_trial_label = None
         self.annotation_onsets = []
         self.annotation_durations = []
         self.annotation_descriptions = []
@@ -29,10 +127,16 @@ class TrialRecorder(QObject):
         self.base_output_path = Path(base_output_path)
         self.metadata = metadata
         self.ongoing_start_time = now_absolute()
+        self.trial_start_lsl_time = pylsl.local_clock()
         self.trial_number = 1
-        self.next_segment = False
+        self.segment_boundary = SegmentBoundary()
+        self.segment_sample_indices = []
         self.mutex = QReadWriteLock()
         self.segment_completed = False
+        self.writer_pool = writer_pool or shared_writer_pool()
+        self.output_backend = output_backend or NativeOutputBackend()
+        self.spool_fsync_interval = spool_fsync_interval
+        self.spool = None
 
     @abstractmethod
     def start_acquisition(self):
@@ -47,9 +151,111 @@ class TrialRecorder(QObject):
         pass
 
     @abstractmethod
-    def coalesce_and_save(self, raws):
+    def coalesce_and_save(self, raws, trial):
         pass
 
+    def close_session(self):
+        pass
+
+    def trial_data(self, raws):
+        """Hands the acquired data of the trial over to the writer pool.
+
+        Recorders that acquire into reusable buffers must return data the next
+        trial will not overwrite.
+        """
+        return raws
+
+    def snapshot_trial(self):
+        self.mutex.lockForRead()
+        trial = {
+            "trial_number": self.trial_number,
+            "trial_id": self.current_trial_id,
+            "trial_label": self.current_trial_label,
+            "annotation_onsets": list(self.annotation_onsets),
+            "annotation_durations": list(self.annotation_durations),
+            "annotation_descriptions": list(self.annotation_descriptions),
+            "segment_sample_indices": list(self.segment_sample_indices),
+            "segment_lsl_times": [
+                lsl_time for _, lsl_time in self.segment_boundary.timestamps
+            ],
+            "trial_start_lsl_time": self.trial_start_lsl_time,
+        }
+        self.mutex.unlock()
+        return trial
+
+    def trial_key(self, trial=None):
+        if trial is None:
+            return subject_string_trial(
+                self.metadata, self.trial_number, self.current_trial_id
+            )
+        return subject_string_trial(
+            self.metadata, trial["trial_number"], trial["trial_id"]
+        )
+
+    def open_spool(self, modality, channel_count=0, dtype="float32", **header):
+        """Starts spooling the trial to disk when a fsync interval is configured."""
+        if self.spool_fsync_interval is None:
+            return None
+        trial_key = self.trial_key()
+        header.update(
+            modality=modality,
+            trial_key=trial_key,
+            channel_count=channel_count,
+            dtype=str(dtype),
+        )
+        self.spool = ChunkSpool(
+            spool_path(self.base_output_path, trial_key, modality),
+            header,
+            fsync_interval=self.spool_fsync_interval,
+        )
+        return self.spool
+
+    def mark_segment_boundary(self, sample_index):
+        self.mutex.lockForWrite()
+        self.segment_sample_indices.append(sample_index)
+        self.mutex.unlock()
+        if self.spool is not None:
+            self.spool.event("boundary", sample_index=int(sample_index))
+
+    def save_sync(
+        self,
+        data_path,
+        trial,
+        sampling_rate,
+        timestamps=None,
+        first_sample_lsl_time=None,
+        encoder_delay=None,
+    ):
+        write_sync_sidecar(
+            data_path,
+            trial,
+            sampling_rate,
+            timestamps,
+            first_sample_lsl_time,
+            encoder_delay,
+        )
+
+    def store_sync(self, modality, trial, sampling_rate, first_sample_lsl_time=None):
+        """Counterpart of ``save_sync`` for streaming output backends."""
+        self.output_backend.end_trial(
+            self.trial_key(trial),
+            modality,
+            {
+                "sampling_rate": sampling_rate,
+                "trial_start_lsl_time": trial["trial_start_lsl_time"],
+                "segment_lsl_times": trial["segment_lsl_times"],
+                "segment_sample_indices": trial["segment_sample_indices"],
+                "first_sample_lsl_time": first_sample_lsl_time,
+            },
+        )
+
+    def _save_trial(self, raws, trial, spool=None):
+        self.coalesce_and_save(raws, trial)
+        if spool is not None:
+            # Kept when saving fails so the trial can still be recovered
+            spool.discard()
+        self.trial_saved_signal.emit(trial["trial_number"])
+
     def run(self) -> None:
         # debugpy.debug_this_thread()
         self.trial_start_event = threading.Event()
@@ -60,29 +266,49 @@ class TrialRecorder(QObject):
             logger.debug("Locking write mutex")
             self.mutex.lockForWrite()
             self.ongoing_start_time = now_absolute()
+            self.trial_start_lsl_time = pylsl.local_clock()
             self.current_segment = 1
             self.annotation_onsets.clear()
             self.annotation_durations.clear()
             self.annotation_descriptions.clear()
-            self.next_segment = False
+            self.segment_sample_indices.clear()
+            self.segment_boundary.reset()
             self.mutex.unlock()
             logger.debug("Unlocking mutex")
+            if self.spool is not None:
+                self.spool.event(
+                    "trial",
+                    trial_number=self.trial_number,
+                    trial_id=self.current_trial_id,
+                    trial_label=self.current_trial_label,
+                    trial_start_lsl_time=self.trial_start_lsl_time,
+                )
             raws = []
             start = now_absolute()
             current_trial = 0
             while current_trial < self.trial_segments:
                 logger.debug("Iterating over segments")
                 raws.extend(self.acquire(25))
-                self.mutex.lockForWrite()
-                self.next_segment = False
-                self.mutex.unlock()
+                self.segment_boundary.consume()
                 end = now_absolute()
                 logger.debug(f"Segment duration: {end - start}")
                 current_trial += 1
             self.end_acquisition()
-            self.coalesce_and_save(raws)
+            trial = self.snapshot_trial()
+            data = self.trial_data(raws)
+            spool, self.spool = self.spool, None
+            if spool is not None:
+                spool.close()
+            self.writer_pool.submit(
+                f"{self.__class__.__name__} trial {trial['trial_number']} ({trial['trial_id']})",
+                self._save_trial,
+                data,
+                trial,
+                spool,
+            )
 
             self.trial_number += 1
+        self.close_session()
 
     def handle_protocol_events(self, event_name: str) -> None:
         if (
@@ -105,36 +331,47 @@ class TrialRecorder(QObject):
 
     # TODO Rename this here and in `handle_protocol_events`
     def _extracted_from_handle_protocol_events_(self, event_name):
+        self.mutex.lockForWrite()
+        boundary_time, boundary_lsl_time = now_absolute(), pylsl.local_clock()
         if self.current_segment == 1:
-            onset = (now_absolute() - self.ongoing_start_time) / 1000.0
+            onset = (boundary_time - self.ongoing_start_time) / 1000.0
             duration = -1
             logger.debug(f"{self.__class__.__name__} |First segment sync o={onset}")
 
         elif (
             1 < self.current_segment < self.trial_segments
         ) or self.current_segment == self.trial_segments:
-            onset = (now_absolute() - self.ongoing_start_time) / 1000.0
+            onset = (boundary_time - self.ongoing_start_time) / 1000.0
             duration = onset - self.annotation_onsets[-1]
             logger.debug(
                 f"{self.__class__.__name__} | Intermediary or final sync o={onset} prev d={duration}"
             )
 
-        self.mutex.lockForWrite()
         self.annotation_onsets.append(onset)
         if duration > -1:
             self.annotation_durations.append(duration)
         self.annotation_descriptions.append(event_name)
         # self.ongoing_start_time = now_absolute()
-
-        self.next_segment = True
         self.mutex.unlock()
+        spool = self.spool
+        if spool is not None:
+            spool.event(
+                "sync",
+                onset=onset,
+                duration=duration,
+                description=event_name,
+                lsl_time=boundary_lsl_time,
+            )
+        # Signalled last, the acquisition thread may end the trial and close
+        # the spool as soon as it sees the boundary
+        self.segment_boundary.signal((boundary_time, boundary_lsl_time))
+
         if self.current_segment == self.trial_segments:
             self.segment_completed = True
             # self.wait_for_next_trial()
             self.ready_for_next_signal.emit()
         else:
             self.current_segment += 1
-        self.mutex.unlock()
 
     def wait_for_next_trial(self):
         if self.trial_start_event is not None:
@@ -146,3 +383,6 @@ class TrialRecorder(QObject):
 
     def connect_ready_for_next(self, slot):
         self.ready_for_next_signal.connect(slot)
+
+    def connect_trial_saved(self, slot):
+        self.trial_saved_signal.connect(slot)
@@ -0,0 +1,105 @@
+import logging
+from pathlib import Path
+
+from embld.acquisition.audio_writer import StreamingWavWriter, transcode_to_mp3
+from embld.acquisition.metadata_recorder import _write_metadata_and_annotations
+from embld.acquisition.qtm_recorder import write_c3d
+from embld.acquisition.recorder import write_sync_sidecar
+from embld.acquisition.spool import (
+    SPOOL_SUFFIX,
+    iter_spool,
+    read_spool,
+    read_spool_header,
+    trial_from_events,
+)
+
+logger = logging.getLogger("Spool Recovery")
+
+
+def find_spools(directory):
+    return sorted(Path(directory).rglob(f"*{SPOOL_SUFFIX}"))
+
+
+def _recover_mocap(spool, output_directory):
+    header, frames, timestamps, events = read_spool(spool)
+    trial = trial_from_events(events)
+    target_path = Path(output_directory, f"{header['trial_key']}_mocap.c3d")
+    write_c3d(target_path, frames, header["channels"], header["sampling_rate"])
+    write_sync_sidecar(target_path, trial, header["sampling_rate"], timestamps)
+    return target_path
+
+
+def _recover_audio(spool, output_directory):
+    # Audio spools can be long, stream them to the wav chunk by chunk
+    writer = None
+    first_timestamp = None
+    events = []
+    for kind, record in iter_spool(spool):
+        if kind == "header":
+            header = record
+            writer = StreamingWavWriter(
+                Path(output_directory, f"{header['trial_key']}_audio.wav"),
+                header["channel_count"],
+                header["sampling_rate"],
+            )
+        elif kind == "chunk":
+            samples, timestamps = record
+            if first_timestamp is None and len(timestamps) > 0:
+                first_timestamp = float(timestamps[0])
+            writer.write(samples)
+        else:
+            events.append(record)
+    writer.close()
+    target_path = writer.path
+    if header.get("output_format") == "mp3":
+        target_path = transcode_to_mp3(target_path, bitrate="320k")
+    write_sync_sidecar(
+        target_path,
+        trial_from_events(events),
+        header["sampling_rate"],
+        first_sample_lsl_time=first_timestamp,
+    )
+    return target_path
+
+
+def _recover_annotation(spool, output_directory):
+    header, _, _, events = read_spool(spool)
+    trial = trial_from_events(events)
+    target_path = Path(output_directory, f"{header['trial_key']}_annotation.json")
+    _write_metadata_and_annotations(
+        header["metadata"],
+        trial["trial_number"],
+        trial["trial_id"],
+        trial["trial_label"],
+        trial["annotation_onsets"],
+        trial["annotation_durations"],
+        str(target_path),
+        segment_lsl_times=trial["segment_lsl_times"],
+    )
+    return target_path
+
+
+_RECOVERERS = {
+    "mocap": _recover_mocap,
+    "audio": _recover_audio,
+    "annotation": _recover_annotation,
+}
+
+
+def recover_spool(spool, output_directory, remove=False):
+    """Rebuilds the recording of an interrupted trial from its spool.
+
+    The trial is rebuilt up to the last record that reached the disk, segments
+    whose sync never arrived are simply missing from the annotations.
+    """
+    spool = Path(spool)
+    with open(spool, "rb") as fp:
+        modality = read_spool_header(fp)["modality"]
+    if modality not in _RECOVERERS:
+        raise ValueError(f"Cannot recover {modality} spools ({spool})")
+    Path(output_directory).mkdir(parents=True, exist_ok=True)
+    target_path = _RECOVERERS[modality](spool, output_directory)
+    logger.info(f"{spool.name} recovered as {str(target_path)}")
+    if remove:
+        spool.unlink()
+    return target_path
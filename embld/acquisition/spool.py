@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("Spool")
+
+SPOOL_DIRECTORY = ".spool"
+SPOOL_SUFFIX = ".spool"
+
+_MAGIC = b"EMBLDSP1"
+_LENGTH = struct.Struct("<I")
+# Record kind and payload length, chunk payloads start with their sample count
+_RECORD = struct.Struct("<BI")
+_CHUNK = 1
+_EVENT = 2
+
+
+class ChunkSpool:
+    """Append-only file holding the chunks and events of one trial of a recorder.
+
+    Chunks are written with their LSL timestamps as they are pulled and the
+    file is fsynced at most every ``fsync_interval`` seconds, so a crash loses
+    at most that much of the trial. The spool is removed once the trial has
+    been saved; leftovers are rebuilt by ``0_recover_spool.py``.
+    """
+
+    def __init__(self, path, header, fsync_interval=1.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(header.get("dtype", "float32"))
+        self.channel_count = header.get("channel_count", 0)
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self._fp = open(self.path, "wb")
+        header_bytes = json.dumps(header).encode("utf-8")
+        self._fp.write(_MAGIC + _LENGTH.pack(len(header_bytes)) + header_bytes)
+        self._last_sync = None
+        self._sync()
+
+    def _sync(self):
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._last_sync = time.monotonic()
+
+    def _write(self, kind, *payload):
+        length = sum(len(part) for part in payload)
+        with self.lock:
+            if self._fp.closed:
+                return
+            self._fp.write(_RECORD.pack(kind, length))
+            for part in payload:
+                self._fp.write(part)
+            if time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def append(self, samples, timestamps):
+        if len(samples) == 0:
+            return
+        samples = np.ascontiguousarray(samples, dtype=self.dtype)
+        timestamps = np.ascontiguousarray(timestamps, dtype="<f8")
+        self._write(
+            _CHUNK,
+            _LENGTH.pack(len(samples)),
+            samples.tobytes(),
+            timestamps.tobytes(),
+        )
+
+    def event(self, name, **fields):
+        fields["event"] = name
+        self._write(_EVENT, json.dumps(fields).encode("utf-8"))
+
+    def close(self):
+        with self.lock:
+            if not self._fp.closed:
+                self._sync()
+                self._fp.close()
+
+    def discard(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+def spool_path(base_output_path, trial_key, modality):
+    return Path(
+        base_output_path,
+        "recordings",
+        SPOOL_DIRECTORY,
+        f"{trial_key}_{modality}{SPOOL_SUFFIX}",
+    )
+
+
+def read_spool_header(fp):
+    if fp.read(len(_MAGIC)) != _MAGIC:
+        raise ValueError(f"{fp.name} is not a spool file")
+    (length,) = _LENGTH.unpack(fp.read(_LENGTH.size))
+    return json.loads(fp.read(length).decode("utf-8"))
+
+
+def iter_spool(path):
+    """Yields the header then ``("chunk", (samples, timestamps))`` and
+    ``("event", dict)`` records, stopping silently at a torn last record."""
+    with open(path, "rb") as fp:
+        header = read_spool_header(fp)
+        yield "header", header
+        dtype = np.dtype(header.get("dtype", "float32"))
+        channel_count = header.get("channel_count", 0)
+        while True:
+            record = fp.read(_RECORD.size)
+            if len(record) < _RECORD.size:
+                return
+            kind, length = _RECORD.unpack(record)
+            payload = fp.read(length)
+            if len(payload) < length:
+                logger.warning(f"{path} ends with a partial record, dropping it")
+                return
+            if kind == _CHUNK:
+                (count,) = _LENGTH.unpack_from(payload)
+                sample_bytes = count * channel_count * dtype.itemsize
+                samples = np.frombuffer(
+                    payload, dtype=dtype, count=count * channel_count, offset=4
+                ).reshape(count, channel_count)
+                timestamps = np.frombuffer(
+                    payload, dtype="<f8", count=count, offset=4 + sample_bytes
+                )
+                yield "chunk", (samples, timestamps)
+            elif kind == _EVENT:
+                yield "event", json.loads(payload.decode("utf-8"))
+
+
+def read_spool(path):
+    """Returns the header, all samples, their timestamps and the events."""
+    header = None
+    chunks, chunk_timestamps, events = [], [], []
+    for kind, record in iter_spool(path):
+        if kind == "header":
+            header = record
+        elif kind == "chunk":
+            chunks.append(record[0])
+            chunk_timestamps.append(record[1])
+        else:
+            events.append(record)
+    dtype = np.dtype(header.get("dtype", "float32"))
+    if chunks:
+        samples = np.concatenate(chunks)
+        timestamps = np.concatenate(chunk_timestamps)
+    else:
+        samples = np.empty((0, header.get("channel_count", 0)), dtype=dtype)
+        timestamps = np.empty(0)
+    return header, samples, timestamps, events
+
+
+def trial_from_events(events):
+    """Rebuilds the trial snapshot of ``TrialRecorder`` from spooled events."""
+    trial = {
+        "trial_number": None,
+        "trial_id": "",
+        "trial_label": None,
+        "annotation_onsets": [],
+        "annotation_durations": [],
+        "annotation_descriptions": [],
+        "segment_sample_indices": [],
+        "segment_lsl_times": [],
+        "trial_start_lsl_time": None,
+    }
+    for event in events:
+        if event["event"] == "trial":
+            trial["trial_number"] = event["trial_number"]
+            trial["trial_id"] = event["trial_id"]
+            trial["trial_label"] = event["trial_label"]
+            trial["trial_start_lsl_time"] = event["trial_start_lsl_time"]
+        elif event["event"] == "sync":
+            trial["annotation_onsets"].append(event["onset"])
+            if event["duration"] > -1:
+                trial["annotation_durations"].append(event["duration"])
+            trial["annotation_descriptions"].append(event["description"])
+            trial["segment_lsl_times"].append(event["lsl_time"])
+        elif event["event"] == "boundary":
+            trial["segment_sample_indices"].append(event["sample_index"])
+    return trial
@@ -0,0 +1,142 @@
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from embld.experiment.utils import subject_string_global
+
+logger = logging.getLogger("Output Backend")
+
+_CHUNK_SECONDS = 1.0
+
+
+class OutputBackend:
+    """Where recorders put their samples besides (or instead of) their own files.
+
+    ``streaming`` backends receive every block as it is acquired and make
+    recorders skip their end of trial c3d/mp3/fif export.
+    """
+
+    streaming = False
+
+    def begin_trial(
+        self, trial_key, modality, channel_count, dtype, sampling_rate, attributes=None
+    ):
+        pass
+
+    def append(self, trial_key, modality, block, timestamps=None):
+        pass
+
+    def end_trial(self, trial_key, modality, attributes=None):
+        pass
+
+    def annotate(self, trial_key, attributes):
+        pass
+
+    def close(self):
+        pass
+
+
+class NativeOutputBackend(OutputBackend):
+    """Recorders write their own format at the end of each trial (the default)."""
+
+
+class HDF5OutputBackend(OutputBackend):
+    """Appends every block to one chunked, compressed HDF5 file per session.
+
+    Each trial is a group named after the trial, holding one resizable dataset
+    per modality (and ``<modality>_timestamps`` when timestamps are given);
+    annotations and sync information are stored as attributes. The file is
+    flushed after every block so a crash loses at most the block being written.
+    """
+
+    streaming = True
+
+    def __init__(self, path, compression="gzip", compression_opts=4):
+        import h5py
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = h5py.File(self.path, "a")
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.lock = threading.Lock()
+
+    def _dataset(self, group, name, channel_count, dtype, chunk_rows):
+        shape = (0,) if channel_count is None else (0, channel_count)
+        maxshape = (None,) if channel_count is None else (None, channel_count)
+        chunks = (chunk_rows,) if channel_count is None else (chunk_rows, channel_count)
+        if name in group:
+            del group[name]
+        return group.create_dataset(
+            name,
+            shape=shape,
+            maxshape=maxshape,
+            chunks=chunks,
+            dtype=dtype,
+            compression=self.compression,
+            compression_opts=self.compression_opts,
+            shuffle=True,
+        )
+
+    def begin_trial(
+        self, trial_key, modality, channel_count, dtype, sampling_rate, attributes=None
+    ):
+        chunk_rows = max(1, int(sampling_rate * _CHUNK_SECONDS))
+        with self.lock:
+            group = self.file.require_group(trial_key)
+            dataset = self._dataset(group, modality, channel_count, dtype, chunk_rows)
+            self._dataset(group, f"{modality}_timestamps", None, np.float64, chunk_rows)
+            dataset.attrs["sampling_rate"] = sampling_rate
+            for key, value in (attributes or {}).items():
+                if value is not None:
+                    dataset.attrs[key] = value
+            self.file.flush()
+
+    def append(self, trial_key, modality, block, timestamps=None):
+        if len(block) == 0:
+            return
+        with self.lock:
+            group = self.file[trial_key]
+            dataset = group[modality]
+            start = dataset.shape[0]
+            dataset.resize(start + len(block), axis=0)
+            dataset[start:] = block
+            if timestamps is not None:
+                timestamp_dataset = group[f"{modality}_timestamps"]
+                timestamp_dataset.resize(start + len(timestamps), axis=0)
+                timestamp_dataset[start:] = timestamps
+            self.file.flush()
+
+    def end_trial(self, trial_key, modality, attributes=None):
+        with self.lock:
+            dataset = self.file[trial_key][modality]
+            for key, value in (attributes or {}).items():
+                if value is not None:
+                    dataset.attrs[key] = value
+            self.file.flush()
+        logger.info(f"{modality} of {trial_key} stored in {str(self.path)}")
+
+    def annotate(self, trial_key, attributes):
+        with self.lock:
+            group = self.file.require_group(trial_key)
+            for key, value in attributes.items():
+                if value is not None:
+                    group.attrs[key] = value
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def create_output_backend(parameters, metadata, base_output_path="."):
+    backend = parameters.get("output_backend", "native")
+    if backend == "native":
+        return NativeOutputBackend()
+    if backend == "hdf5":
+        return HDF5OutputBackend(
+            Path(base_output_path, f"{subject_string_global(metadata)}.h5")
+        )
+    raise ValueError(f"Unknown output backend {backend}, expected native or hdf5")
@@ -0,0 +1,75 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger("Writer Pool")
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+class TrialWriterPool:
+    """Persists finished trials in the background so the next trial can start.
+
+    At most ``max_pending`` trials may be queued or being written at once,
+    ``submit`` blocks the calling recorder beyond that (back-pressure) so a
+    slow disk cannot make unsaved trials pile up in memory.
+    """
+
+    def __init__(self, max_workers=2, max_pending=4):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="TrialWriter"
+        )
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, description, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            logger.warning(f"Writer queue full, waiting before queuing {description}")
+            self._slots.acquire()
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(lambda f: self._completed(description, f))
+        return future
+
+    def _completed(self, description, future):
+        with self._lock:
+            self._pending.discard(future)
+        self._slots.release()
+        exception = future.exception()
+        if exception is not None:
+            logger.error(f"Failed to save {description}: {exception}")
+        else:
+            logger.info(f"Saved {description}")
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def wait_for_pending(self, timeout=None):
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending, timeout=timeout)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def shared_writer_pool():
+    global _shared_pool
+    # Recorders start on their own threads, they must all share one pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = TrialWriterPool()
+        return _shared_pool
+
+
+def shutdown_writer_pool():
+    global _shared_pool
+    with _shared_pool_lock:
+        pool, _shared_pool = _shared_pool, None
+    if pool is not None:
+        logger.info(f"Waiting for {pool.pending()} pending trial writes...")
+        pool.shutdown()
@@ -1,10 +1,20 @@
+import functools
 import itertools
+import random
 import re
-from random import randint
 
 from embld.configuration import APP_PARAMETERS
 
-__composition_types = APP_PARAMETERS["composition_types"]
+_composition_types = APP_PARAMETERS["composition_types"]
+# rand(a,b) parameters are drawn from their own generator so that expanding
+# configurations lazily never shifts the seeded sampling sequence
+_rand = random.Random()
+_ARGUMENT_PATTERN = re.compile(r"(\{[^}]*\})")
+_RAND_PATTERN = re.compile(r"rand\((\d+),(\d+)\)")
+_compiled_actions = {}
+# Expanded variants by (action id, mod), and the actions they were expanded from
+_pending_variants = {}
+_cached_actions = None
 
 
 def generate_actions():
@@ -29,71 +39,354 @@ def generate_actions():
     return final_actions
 
 
+def _escape(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class InstructionTemplate:
+    """Instruction compiled once into a ``str.format`` string.
+
+    ``slots`` are the distinct ``{name}`` placeholders left to fill, in
+    order of first appearance; ``bind`` bakes constant values in.
+    """
+
+    __slots__ = ("parts", "slots", "format_string")
+
+    def __init__(self, text=None, parts=None):
+        if parts is None:
+            parts = _ARGUMENT_PATTERN.split(text)
+        self.parts = parts
+        self.slots = list(dict.fromkeys(parts[1::2]))
+        format_parts = []
+        for position, part in enumerate(parts):
+            if position % 2 == 0:
+                format_parts.append(_escape(part))
+            else:
+                format_parts.append(f"{{{self.slots.index(part)}}}")
+        self.format_string = "".join(format_parts)
+
+    def bind(self, values):
+        """Template with the slots of ``values`` replaced by their value."""
+        parts = [self.parts[0]]
+        for position in range(1, len(self.parts), 2):
+            slot = self.parts[position]
+            if slot in values:
+                parts[-1] += values[slot] + self.parts[position + 1]
+            else:
+                parts.extend((slot, self.parts[position + 1]))
+        return InstructionTemplate(parts=parts)
+
+    def rename(self, names):
+        """Template with its slots renamed after ``names``."""
+        if not self.slots:
+            return self
+        return InstructionTemplate(
+            parts=[
+                names.get(part, part) if position % 2 else part
+                for position, part in enumerate(self.parts)
+            ]
+        )
+
+    def substitute(self, templates):
+        """Template with every slot replaced by the template it maps to."""
+        parts = [self.parts[0]]
+        for position in range(1, len(self.parts), 2):
+            inner = templates[self.parts[position]].parts
+            parts[-1] += inner[0]
+            parts.extend(inner[1:])
+            parts[-1] += self.parts[position + 1]
+        return InstructionTemplate(parts=parts)
+
+    def format_with(self, positions):
+        """``str.format`` string filling each slot with the positional argument
+        ``positions[slot]``."""
+        return "".join(
+            f"{{{positions[part]}}}" if position % 2 else _escape(part)
+            for position, part in enumerate(self.parts)
+        )
+
+    def render(self, *values):
+        """Instruction with the slots filled in, in the order of ``slots``."""
+        return self.format_string.format(*values)
+
+
+@functools.lru_cache(maxsize=None)
+def _template(text):
+    return InstructionTemplate(text)
+
+
+class PendingVariant:
+    """Variant expanded up to its ``rand(a,b)`` parameters.
+
+    Instruction fields whose template still has slots are drawn again every
+    time the variant is rendered, the rest of the fields are resolved once.
+    """
+
+    __slots__ = ("fields", "varying", "rands", "_suffixed")
+
+    def __init__(self, fields, instructions, rands=None):
+        self.fields = fields
+        self.varying = {}
+        self.rands = rands or {}
+        self._suffixed = {}
+        for key, template in instructions.items():
+            if template.slots:
+                self.varying[key] = template
+            else:
+                fields[key] = template.render()
+
+    def suffixed(self, suffix):
+        """Fields, varying instructions and rand bounds of the variant as the
+        constituent ``suffix`` of a composite, computed once per suffix."""
+        if suffix not in self._suffixed:
+            # Constituents draw their rand parameters independently
+            names = {slot: f"{slot[:-1]}{suffix}}}" for slot in self.rands}
+            self._suffixed[suffix] = (
+                {
+                    key + suffix: value
+                    for key, value in self.fields.items()
+                    if key != "instructions" and key != "id"
+                },
+                {
+                    key + suffix: template.rename(names)
+                    for key, template in self.varying.items()
+                },
+                {names[slot]: bounds for slot, bounds in self.rands.items()},
+            )
+        return self._suffixed[suffix]
+
+    def draw(self, rng=None):
+        """Values of the rand parameters, in the order of ``rands``."""
+        rng = rng or _rand
+        return [rng.randint(*bounds) for bounds in self.rands.values()]
+
+    def render(self, rand_values=None):
+        """Variant with the rand parameters set to ``rand_values``, drawn if None."""
+        variant = self.fields.copy()
+        if self.varying:
+            if rand_values is None:
+                rand_values = self.draw()
+            values = {slot: str(value) for slot, value in zip(self.rands, rand_values)}
+            for key, template in self.varying.items():
+                variant[key] = template.render(
+                    *[values[slot] for slot in template.slots]
+                )
+        return variant
+
+
+class AtomicTemplate:
+    """One modifier of an atomic action with its instruction parameters resolved.
+
+    Labels are baked into the template, ``{mod}`` is bound by ``pending`` and
+    ``rand(a,b)`` parameters are left to render time.
+    """
+
+    __slots__ = ("fields", "template", "rands")
+
+    def __init__(self, action, modifier):
+        self.fields = action.copy()
+        self.fields.update(modifier)
+        del self.fields["modifiers"]
+        template = _template(self.fields["instruction"])
+        labels = {}
+        self.rands = {}
+        for slot in template.slots:
+            if slot == "{mod}":
+                continue
+            key = slot[1:-1]
+            field = self.fields[key]
+            rand_match = _RAND_PATTERN.match(field) if isinstance(field, str) else None
+            if rand_match:
+                self.rands[slot] = (int(rand_match.group(1)), int(rand_match.group(2)))
+            elif len(field) == 1:
+                labels[slot] = APP_PARAMETERS[key][field[0]]["label"]
+            else:
+                labels[slot] = ",".join(
+                    [APP_PARAMETERS[key][param]["label"] for param in field]
+                )
+        self.template = template.bind(labels)
+
+    def pending(self, mod: str = None):
+        return PendingVariant(
+            self.fields.copy(),
+            {"instruction": self.template.bind({"{mod}": mod or ""})},
+            self.rands,
+        )
+
+
+class CompositeTemplate:
+    """Syntactic pattern of a composite with its constituents looked up once."""
+
+    __slots__ = (
+        "action",
+        "constituents",
+        "counts",
+        "modifiers",
+        "template",
+        "arguments",
+        "suffixes",
+    )
+
+    def __init__(self, action):
+        composition_type = _composition_types[action["composition_type"]]
+        self.action = action
+        self.constituents = [
+            APP_PARAMETERS["actions"][c] for c in action["constituents"]
+        ]
+        self.counts = [action_variant_count(c) for c in self.constituents]
+        self.modifiers = composition_type["modifiers"]
+        self.template = _template(
+            composition_type["syntactic_patterns"][str(len(self.constituents))]
+        )
+        # Constituents fill the pattern arguments by order of appearance, the
+        # first constituent filling a repeated argument
+        arguments = self.template.parts[1::2]
+        self.suffixes = [f"_{arg_index}" for arg_index in range(len(arguments))]
+        self.arguments = [
+            f"instruction{self.suffixes[arguments.index(slot)]}"
+            for slot in self.template.slots
+        ]
+
+    def digits(self, index):
+        """Constituent variants of variant ``index``, in ``itertools.product``
+        order where the last constituent varies fastest."""
+        digits = []
+        for count in reversed(self.counts):
+            index, digit = divmod(index, count)
+            digits.append(digit)
+        digits.reverse()
+        return digits
+
+    def combine(self, combination):
+        """Pending variant of the composite of pending constituent variants."""
+        fields = self.action.copy()
+        fields["instruction"] = None
+        varying = {}
+        rands = {}
+        for constituent, suffix in zip(combination, self.suffixes):
+            constituent_fields, constituent_varying, constituent_rands = (
+                constituent.suffixed(suffix)
+            )
+            fields.update(constituent_fields)
+            varying.update(constituent_varying)
+            rands.update(constituent_rands)
+        if not varying:
+            fields["instruction"] = self.template.render(
+                *[fields[key] for key in self.arguments]
+            )
+            return PendingVariant(fields, {})
+        varying["instruction"] = self.template.substitute(
+            {
+                slot: varying.get(key) or InstructionTemplate(parts=[fields[key]])
+                for slot, key in zip(self.template.slots, self.arguments)
+            }
+        )
+        return PendingVariant(fields, varying, rands)
+
+
+def compile_action(action):
+    """Templates of ``action``: one ``AtomicTemplate`` per modifier, or a
+    ``CompositeTemplate``. Compiled once per action id."""
+    _check_actions()
+    if action["id"] not in _compiled_actions:
+        if action["type"] == "composite":
+            compiled = CompositeTemplate(action)
+        elif "modifiers" in action:
+            compiled = [
+                AtomicTemplate(action, modifier) for modifier in action["modifiers"]
+            ]
+        else:
+            compiled = None
+        _compiled_actions[action["id"]] = compiled
+    return _compiled_actions[action["id"]]
+
+
+def clear_action_cache():
+    """Forgets the compiled and expanded actions, to be called whenever the
+    actions of ``APP_PARAMETERS`` are modified in place."""
+    global _cached_actions
+    _compiled_actions.clear()
+    _pending_variants.clear()
+    _cached_actions = APP_PARAMETERS.get("actions")
+
+
+def _check_actions():
+    # Replacing the actions altogether invalidates the caches on its own
+    if APP_PARAMETERS.get("actions") is not _cached_actions:
+        clear_action_cache()
+
+
+def _pending_variant(action, index, mod: str = None):
+    """Variant ``index`` of ``action`` expanded up to its rand parameters.
+
+    Variants are expanded once per (action id, mod) and shared by every
+    composite they are a constituent of.
+    """
+    # The modifier of a composite only applies to its constituents
+    key = (action["id"], mod if action["type"] == "atomic" else None)
+    variants = _pending_variants.get(key)
+    if variants is None:
+        variants = _pending_variants[key] = [None] * action_variant_count(action)
+    if variants[index] is None:
+        compiled = compile_action(action)
+        if action["type"] == "composite":
+            variants[index] = compiled.combine(
+                [
+                    _pending_variant(constituent, digit, constituent_mod)
+                    for constituent, digit, constituent_mod in zip(
+                        compiled.constituents,
+                        compiled.digits(index),
+                        compiled.modifiers,
+                    )
+                ]
+            )
+        elif compiled is None:
+            instructions = {}
+            if "instruction" in action:
+                instructions["instruction"] = InstructionTemplate(
+                    parts=[action["instruction"]]
+                )
+            variants[index] = PendingVariant(action.copy(), instructions)
+        else:
+            variants[index] = compiled[index].pending(mod)
+    return variants[index]
+
+
+def _pending_variants_of(action, mod: str = None):
+    """Every variant of ``action`` expanded up to its rand parameters."""
+    _check_actions()
+    key = (action["id"], mod if action["type"] == "atomic" else None)
+    variants = _pending_variants.get(key)
+    if variants is None or None in variants:
+        if action["type"] != "composite":
+            return [
+                _pending_variant(action, index, mod)
+                for index in range(action_variant_count(action))
+            ]
+        compiled = compile_action(action)
+        variants = [
+            compiled.combine(combination)
+            for combination in itertools.product(
+                *[
+                    _pending_variants_of(constituent, constituent_mod)
+                    for constituent, constituent_mod in zip(
+                        compiled.constituents, compiled.modifiers
+                    )
+                ]
+            )
+        ]
+        _pending_variants[key] = variants
+    return variants
+
+
 def _process_atomic_action(action, mod: str = None):
-    local_actions = []
-    rand_modifier_param_pattern = re.compile(r"rand\((\d+),(\d+)\)")
     if "modifiers" in action:
-        for variant in action["modifiers"]:
-            v_action = action.copy()
-            v_action.update(variant)
-            del v_action["modifiers"]
-            # instruction = v_action['instruction']
-            instr_arguments = __extract_instruction_arguments(v_action["instruction"])
-            for inst_arg in instr_arguments:
-                if inst_arg == "{mod}":
-                    param_value = mod or ""
-                else:
-                    arg_key = inst_arg[1:-1]
-                    param_field = v_action[arg_key]
-                    rand_match = None
-                    if isinstance(param_field, str):
-                        rand_match = rand_modifier_param_pattern.match(param_field)
-                    if rand_match:
-                        param_value = str(
-                            randint(int(rand_match.group(1)), int(rand_match.group(2)))
-                        )
-                    elif len(param_field) == 1:
-                        param_value = APP_PARAMETERS[arg_key][param_field[0]]["label"]
-                    else:
-                        param_value = ",".join(
-                            [
-                                APP_PARAMETERS[arg_key][param]["label"]
-                                for param in param_field
-                            ]
-                        )
-                v_action["instruction"] = v_action["instruction"].replace(
-                    inst_arg, param_value
-                )
-            local_actions.append(v_action)
-    else:
-        local_actions.append(action)
-    return local_actions
+        return [variant.render() for variant in _pending_variants_of(action, mod)]
+    return [action]
 
 
 def _process_composite_action(action):
-    local_actions = []
-    composition_type = __composition_types[action["composition_type"]]
-    constituents = action["constituents"]
-    constituents = [APP_PARAMETERS["actions"][c] for c in constituents]
-    constituent_actions = []
-    for ci in range(len(constituents)):
-        mod = composition_type["modifiers"][ci]
-        constituent_actions.append(_process_action(constituents[ci], mod))
-    combinations = list(itertools.product(*constituent_actions))
-    syntactic_pattern = composition_type["syntactic_patterns"][str(len(constituents))]
-    syntactic_pattern_args = __extract_instruction_arguments(syntactic_pattern)
-    for c in combinations:
-        v_action = action.copy()
-        v_action["instruction"] = syntactic_pattern
-        for arg_index in range(len(syntactic_pattern_args)):
-            for key in c[arg_index]:
-                if key not in ["instructions", "id"]:
-                    v_action[f"{key}_{str(arg_index)}"] = c[arg_index][key]
-            v_action["instruction"] = v_action["instruction"].replace(
-                syntactic_pattern_args[arg_index], c[arg_index]["instruction"]
-            )
-        local_actions.append(v_action)
-    return local_actions
+    return [variant.render() for variant in _pending_variants_of(action)]
 
 
 def _process_action(action, mod: str = None):
@@ -106,5 +399,27 @@ def _process_action(action, mod: str = None):
     return local_actions
 
 
-def __extract_instruction_arguments(instruction):
-    return re.findall(r"\{[^}]*\}", instruction)
+def action_variant_count(action):
+    """Number of variants ``_process_action`` expands ``action`` into."""
+    if action["type"] == "atomic":
+        return len(action["modifiers"]) if "modifiers" in action else 1
+    if action["type"] == "composite":
+        count = 1
+        for constituent in action["constituents"]:
+            count *= action_variant_count(APP_PARAMETERS["actions"][constituent])
+        return count
+    return 0
+
+
+def pending_action_variant(action, index, mod: str = None):
+    """Variant ``index`` of ``action`` with its rand parameters left undrawn."""
+    _check_actions()
+    return _pending_variant(action, index, mod)
+
+
+def action_variant(action, index, mod: str = None):
+    """Variant ``index`` of ``_process_action(action, mod)``, expanding only it."""
+    if action["type"] == "atomic" and "modifiers" not in action:
+        return action
+    _check_actions()
+    return _pending_variant(action, index, mod).render()
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import random
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+from embld.experiment.action_parser import pending_action_variant
+
+logger = logging.getLogger("Configuration Catalogue")
+
+CATALOGUE_MAGIC = b"EMBLDCAT"
+CATALOGUE_VERSION = 1
+CATALOGUE_SUFFIX = ".cat"
+_ALIGNMENT = 64
+# Parameters the generated configurations depend on
+_CATALOGUE_PARAMETERS = (
+    "actions",
+    "body_parts",
+    "directions",
+    "speed",
+    "composition_types",
+)
+# rand(a,b) parameters are drawn from their own generator, as in action_parser
+_rand = random.Random()
+
+
+def catalogue_hash(parameters, include_successions=(2, 3), symmetric_combinations=True):
+    """Digest of everything the configurations of ``parameters`` depend on."""
+    description = {
+        "version": CATALOGUE_VERSION,
+        "parameters": {key: parameters[key] for key in _CATALOGUE_PARAMETERS},
+        "include_successions": list(include_successions),
+        "symmetric_combinations": symmetric_combinations,
+    }
+    return hashlib.sha1(
+        json.dumps(description, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def catalogue_path(parameters, digest):
+    directory = parameters.get("catalogue_location") or Path("resources", "catalogue")
+    return Path(directory, f"{digest}{CATALOGUE_SUFFIX}")
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+
+    def intern(self, string):
+        if string not in self.ids:
+            self.ids[string] = len(self.ids)
+        return self.ids[string]
+
+    def columns(self):
+        encoded = [string.encode("utf-8") for string in self.ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(string) for string in encoded])
+        return {
+            "strings": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "string_offsets": offsets,
+        }
+
+
+def _offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    return offsets
+
+
+def build_catalogue(space, path, digest):
+    """Writes every configuration of ``space`` to a columnar catalogue.
+
+    Each configuration is stored as (field, JSON value) pairs of interned
+    strings; instruction fields with rand parameters are stored as format
+    strings over the rand bounds of the configuration, drawn when read.
+    """
+    strings = _StringTable()
+    ids = []
+    field_keys, field_values, field_lengths = [], [], []
+    varying_keys, varying_formats, varying_lengths = [], [], []
+    rand_bounds, rand_lengths = [], []
+    for action_index, variant in zip(*space.layout()):
+        pending = pending_action_variant(space.actions[action_index], int(variant))
+        ids.append(strings.intern(pending.fields["id"]))
+        for key, value in pending.fields.items():
+            field_keys.append(strings.intern(key))
+            field_values.append(strings.intern(json.dumps(value)))
+        field_lengths.append(len(pending.fields))
+        positions = {slot: position for position, slot in enumerate(pending.rands)}
+        for key, template in pending.varying.items():
+            varying_keys.append(strings.intern(key))
+            varying_formats.append(strings.intern(template.format_with(positions)))
+        varying_lengths.append(len(pending.varying))
+        rand_bounds.extend(pending.rands.values())
+        rand_lengths.append(len(pending.rands))
+
+    columns = strings.columns()
+    columns.update(
+        {
+            "ids": np.asarray(ids, dtype=np.uint32),
+            "field_offsets": _offsets(field_lengths),
+            "field_keys": np.asarray(field_keys, dtype=np.uint32),
+            "field_values": np.asarray(field_values, dtype=np.uint32),
+            "varying_offsets": _offsets(varying_lengths),
+            "varying_keys": np.asarray(varying_keys, dtype=np.uint32),
+            "varying_formats": np.asarray(varying_formats, dtype=np.uint32),
+            "rand_offsets": _offsets(rand_lengths),
+            "rand_bounds": np.asarray(rand_bounds, dtype=np.int64).reshape(-1, 2),
+        }
+    )
+    _write_columns(path, {"hash": digest, "count": len(ids)}, columns)
+    logger.info(f"{len(ids)} configurations catalogued in {path}")
+    return path
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _write_columns(path, header, columns):
+    # Column offsets depend on the header length, which depends on them
+    descriptions = {}
+    header_length = 0
+    while True:
+        offset = _aligned(len(CATALOGUE_MAGIC) + 8 + header_length)
+        for name, column in columns.items():
+            descriptions[name] = {
+                "dtype": column.dtype.str,
+                "shape": list(column.shape),
+                "offset": offset,
+            }
+            offset = _aligned(offset + column.nbytes)
+        encoded = json.dumps(
+            {**header, "version": CATALOGUE_VERSION, "columns": descriptions}
+        ).encode("utf-8")
+        if len(encoded) == header_length:
+            break
+        header_length = len(encoded)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = path.with_name(f"{path.name}.partial")
+    with open(partial_path, "wb") as fp:
+        fp.write(CATALOGUE_MAGIC)
+        fp.write(np.uint64(len(encoded)).tobytes())
+        fp.write(encoded)
+        for name, column in columns.items():
+            fp.seek(descriptions[name]["offset"])
+            fp.write(np.ascontiguousarray(column).tobytes())
+    os.replace(partial_path, path)
+
+
+class ConfigurationCatalogue(Sequence):
+    """Configurations read from a memory mapped catalogue file.
+
+    Only the configurations accessed are decoded. Rand parameters are drawn
+    anew on every access unless their values are given, ``draw`` and
+    ``configuration`` let a plan store them and render the same instructions
+    again later.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(CATALOGUE_MAGIC)] != CATALOGUE_MAGIC:
+            raise ValueError(f"{self.path} is not a configuration catalogue")
+        start = len(CATALOGUE_MAGIC) + 8
+        header_length = int(
+            np.frombuffer(self._map, np.uint64, 1, len(CATALOGUE_MAGIC))[0]
+        )
+        header = json.loads(self._map[start : start + header_length])
+        if header["version"] != CATALOGUE_VERSION:
+            raise ValueError(
+                f"{self.path} is a version {header['version']} catalogue, "
+                f"expected version {CATALOGUE_VERSION}"
+            )
+        self.hash = header["hash"]
+        self.count = header["count"]
+        self.columns = {
+            name: np.frombuffer(
+                self._map,
+                dtype=np.dtype(description["dtype"]),
+                count=int(np.prod(description["shape"])),
+                offset=description["offset"],
+            ).reshape(description["shape"])
+            for name, description in header["columns"].items()
+        }
+        self._strings = {}
+        self._values = {}
+
+    def string(self, string_id):
+        if string_id not in self._strings:
+            start, end = self.columns["string_offsets"][string_id : string_id + 2]
+            self._strings[string_id] = (
+                self.columns["strings"][start:end].tobytes().decode("utf-8")
+            )
+        return self._strings[string_id]
+
+    def value(self, string_id):
+        if string_id not in self._values:
+            self._values[string_id] = json.loads(self.string(string_id))
+        value = self._values[string_id]
+        # Configurations are handed out as independent dicts
+        return list(value) if isinstance(value, list) else value
+
+    def id_at(self, index):
+        return self.string(int(self.columns["ids"][index]))
+
+    def __len__(self):
+        return self.count
+
+    def _range(self, name, index):
+        return slice(*self.columns[f"{name}_offsets"][index : index + 2].tolist())
+
+    def draw(self, index, rng=None):
+        """Values of the rand parameters of the configuration at ``index``."""
+        rng = rng or _rand
+        return [
+            rng.randint(low, high)
+            for low, high in self.columns["rand_bounds"][
+                self._range("rand", index)
+            ].tolist()
+        ]
+
+    def configuration(self, index, rand_values=None):
+        """Configuration at ``index`` with its rand parameters set to
+        ``rand_values``, drawn if None."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("configuration index out of range")
+        fields = self._range("field", index)
+        configuration = {
+            self.string(key): self.value(value)
+            for key, value in zip(
+                self.columns["field_keys"][fields].tolist(),
+                self.columns["field_values"][fields].tolist(),
+            )
+        }
+        varying = self._range("varying", index)
+        if varying.start != varying.stop:
+            if rand_values is None:
+                rand_values = self.draw(index)
+            values = [str(value) for value in rand_values]
+            for key, format_string in zip(
+                self.columns["varying_keys"][varying].tolist(),
+                self.columns["varying_formats"][varying].tolist(),
+            ):
+                configuration[self.string(key)] = self.string(format_string).format(
+                    *values
+                )
+        return configuration
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.configuration(index)
+
+    def close(self):
+        # The column views must be released before the map can be closed
+        self.columns = {}
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_catalogue(
+    parameters, space, include_successions=(2, 3), symmetric_combinations=True
+):
+    """Catalogue of the configurations of ``space``, None if none was built
+    for the current parameters with ``build_catalogue.py``."""
+    digest = catalogue_hash(parameters, include_successions, symmetric_combinations)
+    path = catalogue_path(parameters, digest)
+    if not path.exists():
+        logger.warning(
+            f"No catalogue for the current configuration, configurations are "
+            f"expanded on the fly (run build_catalogue.py to build {path})"
+        )
+        return None
+    catalogue = ConfigurationCatalogue(path)
+    if len(catalogue) != len(space):
+        catalogue.close()
+        raise ValueError(
+            f"{path} holds {len(catalogue)} configurations, expected {len(space)}"
+        )
+    return catalogue
@@ -0,0 +1,290 @@
+import itertools
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+
+import numpy as np
+
+from embld.configuration import APP_PARAMETERS
+from embld.experiment.action_parser import action_variant, action_variant_count
+
+
+def _successive_actions_key(action_ids):
+    return "_then_".join(action_ids)
+
+
+def _round_robin(counts):
+    """Yields ``(action index, variant)`` in the interleaved order of
+    ``generate_actions``: every action's first variant, then every second..."""
+    for variant in range(max(counts, default=0)):
+        for action_index, count in enumerate(counts):
+            if variant < count:
+                yield action_index, variant
+
+
+def _first_after(positions, position):
+    index = bisect_right(positions, position)
+    return positions[index] if index < len(positions) else None
+
+
+def _first_occurrence(action_ids, positions, symmetric_combinations):
+    """Positions of the first variant tuple of ``action_ids`` among the
+    combinations (or products) of the interleaved action variants."""
+    if not symmetric_combinations:
+        return tuple(positions[action_id][0] for action_id in action_ids)
+    # Taking the earliest possible variant of each action leaves the most room
+    # for the next ones, so the greedy choice is the first occurrence
+    occurrence = []
+    previous = -1
+    for action_id in action_ids:
+        previous = _first_after(positions[action_id], previous)
+        if previous is None:
+            return None
+        occurrence.append(previous)
+    return tuple(occurrence)
+
+
+def successive_compositions(
+    actions, include_successions=(2, 3), symmetric_combinations=True
+):
+    """Successive composites of every distinct ordered set of actions.
+
+    They come in the order in which the first variant tuple of each appears
+    in ``itertools.combinations`` (or ``itertools.product``) of the
+    interleaved variants, without enumerating the variant tuples.
+    """
+    counts = [action_variant_count(action) for action in actions.values()]
+    action_ids = [action["id"] for action in actions.values()]
+    positions = {action_id: [] for action_id in action_ids}
+    for position, (action_index, _) in enumerate(_round_robin(counts)):
+        positions[action_ids[action_index]].append(position)
+    present = [action_id for action_id in action_ids if positions[action_id]]
+
+    compositions = {}
+    for succession_length in include_successions:
+        occurrences = []
+        for succession in itertools.permutations(present, succession_length):
+            occurrence = _first_occurrence(
+                succession, positions, symmetric_combinations
+            )
+            if occurrence is not None:
+                occurrences.append((occurrence, succession))
+        occurrences.sort()
+        for _, succession in occurrences:
+            key = _successive_actions_key(succession)
+            compositions[key] = {
+                "id": key,
+                "type": "composite",
+                "composition_type": "successive",
+                "constituents": list(succession),
+            }
+    return compositions
+
+
+def _constituents(action):
+    return [APP_PARAMETERS["actions"][c] for c in action["constituents"]]
+
+
+def variant_digits(action, variant):
+    """Mixed radix digits of ``variant``: one variant index per constituent,
+    the last constituent varying fastest as in ``itertools.product``."""
+    if action["type"] != "composite":
+        return (variant,)
+    digits = []
+    for constituent in reversed(_constituents(action)):
+        variant, digit = divmod(variant, action_variant_count(constituent))
+        digits.append(digit)
+    return tuple(reversed(digits))
+
+
+def variant_from_digits(action, digits):
+    if action["type"] != "composite":
+        return digits[0]
+    variant = 0
+    for constituent, digit in zip(_constituents(action), digits):
+        variant = variant * action_variant_count(constituent) + digit
+    return variant
+
+
+def _configuration_variant(action, configuration):
+    """Inverse of ``action_variant``, from the fields the variants differ by."""
+    if action["type"] == "atomic":
+        if "modifiers" not in action:
+            return 0
+        for variant, modifier in enumerate(action["modifiers"]):
+            if all(
+                configuration.get(key) == value
+                for key, value in modifier.items()
+                if key != "instruction"
+            ):
+                return variant
+        raise ValueError(f"No variant of {action['id']} matches the configuration")
+    digits = []
+    for constituent_index, constituent in enumerate(_constituents(action)):
+        # Constituent fields are copied with their position as suffix
+        suffix = f"_{constituent_index}"
+        fields = {
+            key[: -len(suffix)]: value
+            for key, value in configuration.items()
+            if key.endswith(suffix)
+        }
+        digits.append(_configuration_variant(constituent, fields))
+    return variant_from_digits(action, digits)
+
+
+def _is_configuration(action):
+    return action["type"] == "atomic" or (
+        action["type"] == "composite" and action["composition_type"] == "successive"
+    )
+
+
+class ConfigurationSpace(Sequence):
+    """Configurations of a list of actions, expanded only when accessed.
+
+    Configurations are interleaved action by action as in
+    ``generate_actions`` and the space only stores one variant count per
+    action, so it can be counted, indexed and iterated without materialising
+    the variant products.
+    """
+
+    def __init__(self, actions, root=None):
+        # Space the ranks of subspaces refer to
+        self.root = self if root is None else root
+        self.actions = []
+        self.counts = []
+        for action in actions:
+            count = action_variant_count(action)
+            if count > 0:
+                self.actions.append(action)
+                self.counts.append(count)
+        self._action_indices = {
+            action["id"]: action_index
+            for action_index, action in enumerate(self.actions)
+        }
+        self._sorted_counts = sorted(self.counts)
+        self._count_prefix = [0, *itertools.accumulate(self._sorted_counts)]
+        self._members = {}
+
+    @classmethod
+    def from_actions(
+        cls, actions, include_successions=(2, 3), symmetric_combinations=True
+    ):
+        """Atomic and successive configurations of the actions of ``config.json``."""
+        actions = dict(actions)
+        actions.update(
+            successive_compositions(
+                actions, include_successions, symmetric_combinations
+            )
+        )
+        return cls(action for action in actions.values() if _is_configuration(action))
+
+    def __len__(self):
+        return self._count_prefix[-1]
+
+    def _positions_before_round(self, variant):
+        # Every action contributes min(count, variant) configurations
+        below = bisect_left(self._sorted_counts, variant)
+        return self._count_prefix[below] + variant * (len(self.counts) - below)
+
+    def _round_members(self, variant):
+        level = bisect_right(self._sorted_counts, variant)
+        if level not in self._members:
+            self._members[level] = [
+                action_index
+                for action_index, count in enumerate(self.counts)
+                if count > variant
+            ]
+        return self._members[level]
+
+    def locate(self, index):
+        """Action index and variant of the configuration at ``index``."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("configuration index out of range")
+        low, high = 0, self._sorted_counts[-1]
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._positions_before_round(middle) <= index:
+                low = middle
+            else:
+                high = middle - 1
+        members = self._round_members(low)
+        return members[index - self._positions_before_round(low)], low
+
+    def layout(self):
+        """Action index and variant of every configuration, as two arrays in
+        index order."""
+        counts = np.asarray(self.counts, dtype=np.int64)
+        action_indices = [np.empty(0, dtype=np.int64)]
+        variants = [np.empty(0, dtype=np.int64)]
+        for variant in range(max(self.counts, default=0)):
+            members = np.flatnonzero(counts > variant)
+            action_indices.append(members)
+            variants.append(np.full(len(members), variant, dtype=np.int64))
+        return np.concatenate(action_indices), np.concatenate(variants)
+
+    def rank(self, action_id, variant):
+        """Index of variant ``variant`` of action ``action_id``, inverse of ``locate``."""
+        action_index = self._action_indices[action_id]
+        if not 0 <= variant < self.counts[action_index]:
+            raise IndexError(f"{action_id} has no variant {variant}")
+        members = self._round_members(variant)
+        return self._positions_before_round(variant) + bisect_left(
+            members, action_index
+        )
+
+    def root_rank(self, index):
+        """Index in ``root`` of the configuration at ``index``."""
+        action_index, variant = self.locate(index)
+        return self.root.rank(self.actions[action_index]["id"], variant)
+
+    def action_at(self, index):
+        """Definition of the action of the configuration at ``index``, unexpanded."""
+        return self.actions[self.locate(index)[0]]
+
+    def count_where(self, predicate=None):
+        """Number of configurations whose action satisfies ``predicate``."""
+        if predicate is None:
+            return len(self)
+        return sum(
+            count
+            for action, count in zip(self.actions, self.counts)
+            if predicate(action_variant(action, 0))
+        )
+
+    def index(self, configuration, start=0, stop=None):
+        if configuration.get("id") not in self._action_indices:
+            raise ValueError(f"{configuration.get('id')} is not in the space")
+        action = self.actions[self._action_indices[configuration["id"]]]
+        index = self.rank(action["id"], _configuration_variant(action, configuration))
+        if not start <= index < (len(self) if stop is None else stop):
+            raise ValueError(f"{configuration['id']} is not in the given range")
+        return index
+
+    def __contains__(self, configuration):
+        try:
+            self.index(configuration)
+        except ValueError:
+            return False
+        return True
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        action_index, variant = self.locate(index)
+        return action_variant(self.actions[action_index], variant)
+
+    def __iter__(self):
+        for action_index, variant in _round_robin(self.counts):
+            yield action_variant(self.actions[action_index], variant)
+
+    def subspace(self, predicate):
+        """Configurations whose action satisfies ``predicate``, in the same order.
+
+        ``predicate`` is evaluated once per action on its first variant, so it
+        may only look at fields all variants share (id, type, constituents...).
+        """
+        return ConfigurationSpace(
+            (action for action in self.actions if predicate(action_variant(action, 0))),
+            root=self.root,
+        )
@@ -0,0 +1,193 @@
+import numpy as np
+
+from embld.configuration import APP_PARAMETERS
+
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+# Variant fields encoded as bitmasks, with the vocabulary they draw from
+FEATURES = {
+    "ids": "actions",
+    "body_parts": "body_parts",
+    "directions": "directions",
+    "speed": "speed",
+}
+
+
+def _words(size):
+    return max(1, (size + 63) // 64)
+
+
+def popcount(masks):
+    """Number of set bits of each row of a (n, words) uint64 mask array."""
+    masks = np.ascontiguousarray(masks, dtype=np.uint64)
+    return _POPCOUNT[masks.view(np.uint8)].reshape(len(masks), -1).sum(axis=1)
+
+
+class Vocabulary:
+    def __init__(self, names):
+        self.bits = {name: bit for bit, name in enumerate(names)}
+        self.words = _words(len(self.bits))
+
+    def encode(self, names):
+        mask = np.zeros(self.words, dtype=np.uint64)
+        for name in names:
+            bit = self.bits[name]
+            mask[bit // 64] |= np.uint64(1 << (bit % 64))
+        return mask
+
+
+def _leaf_count(action):
+    if action["type"] != "composite":
+        return 1
+    return sum(
+        _leaf_count(APP_PARAMETERS["actions"][constituent])
+        for constituent in action["constituents"]
+    )
+
+
+def _field_values(action, field):
+    if field == "ids":
+        return [action["id"]]
+    values = action.get(field, [])
+    return [values] if isinstance(values, str) else values
+
+
+class ConstraintEngine:
+    """Configuration features precompiled to bitmasks, one row per rank.
+
+    Masks are built once per action variant and spread over the ranks of
+    ``space`` with NumPy, so constraints are evaluated over whole candidate
+    rank arrays at once instead of one configuration dict at a time.
+    """
+
+    def __init__(self, space):
+        self.space = space
+        self.vocabularies = {
+            feature: Vocabulary(APP_PARAMETERS[vocabulary])
+            for feature, vocabulary in FEATURES.items()
+        }
+        self._variant_masks = {}
+
+        tables = {feature: [] for feature in FEATURES}
+        first_id, constituent_count = [], []
+        for action, count in zip(space.actions, space.counts):
+            masks = self._masks(action)
+            for feature in FEATURES:
+                tables[feature].append(masks[feature])
+            # Repetitions are counted on the first constituent of successions
+            first = (
+                action["constituents"][0]
+                if action["type"] == "composite"
+                else action["id"]
+            )
+            first_id.append(self.vocabularies["ids"].bits[first])
+            constituent_count.append(_leaf_count(action))
+
+        # Row of each rank in the concatenated per-action variant tables
+        action_indices, variants = space.layout()
+        offsets = np.concatenate([[0], np.cumsum(space.counts)[:-1]]).astype(np.int64)
+        rows = offsets[action_indices] + variants
+        self.masks = {
+            feature: np.concatenate(tables[feature])[rows] for feature in FEATURES
+        }
+        self.first_id = np.asarray(first_id, dtype=np.int64)[action_indices]
+        self.constituent_count = np.asarray(constituent_count, dtype=np.int64)[
+            action_indices
+        ]
+
+    def _masks(self, action):
+        """Feature masks of every variant of ``action``, (variants, words) each."""
+        if action["id"] in self._variant_masks:
+            return self._variant_masks[action["id"]]
+        if action["type"] == "composite":
+            constituents = [
+                self._masks(APP_PARAMETERS["actions"][constituent])
+                for constituent in action["constituents"]
+            ]
+            counts = [len(constituent["ids"]) for constituent in constituents]
+            # itertools.product order, as the variants of the configuration space
+            digits = np.unravel_index(np.arange(int(np.prod(counts))), counts)
+            masks = {}
+            for feature in FEATURES:
+                combined = constituents[0][feature][digits[0]]
+                for constituent, digit in zip(constituents[1:], digits[1:]):
+                    combined = combined | constituent[feature][digit]
+                masks[feature] = combined
+        else:
+            variants = [
+                {**action, **modifier} for modifier in action.get("modifiers", [{}])
+            ]
+            masks = {
+                feature: np.stack(
+                    [
+                        self.vocabularies[feature].encode(
+                            _field_values(variant, feature)
+                        )
+                        for variant in variants
+                    ]
+                )
+                for feature in FEATURES
+            }
+        self._variant_masks[action["id"]] = masks
+        return masks
+
+    def _ranks(self, ranks):
+        return slice(None) if ranks is None else np.asarray(ranks)
+
+    def distinct_ids(self, ranks=None):
+        """Whether the atomic actions of each configuration are all distinct."""
+        ranks = self._ranks(ranks)
+        return popcount(self.masks["ids"][ranks]) == self.constituent_count[ranks]
+
+    def same_body_parts(self, rank, ranks=None):
+        """Whether the body parts of ``rank`` and each of ``ranks`` are nested
+        in one another, configurations without body parts matching everything."""
+        reference = self.masks["body_parts"][rank]
+        candidates = self.masks["body_parts"][self._ranks(ranks)]
+        common = candidates & reference
+        return (
+            ~reference.any()
+            | ~candidates.any(axis=1)
+            | (common == reference).all(axis=1)
+            | (common == candidates).all(axis=1)
+        )
+
+    def satisfies(self, criterion, previous=None, ranks=None):
+        """Whether each configuration meets the optional constraints of a
+        sampling ``criterion``: ``distinct_ids``, and ``same_body_parts`` as
+        the ``previous`` rank picked if there is one."""
+        size = len(self.first_id) if ranks is None else len(ranks)
+        admissible = np.ones(size, dtype=bool)
+        if criterion.get("distinct_ids"):
+            admissible &= self.distinct_ids(ranks)
+        if criterion.get("same_body_parts") and previous is not None:
+            admissible &= self.same_body_parts(previous, ranks)
+        return admissible
+
+    def below_max_repetitions(self, repetitions, max_repetitions, ranks=None):
+        """Whether the first action of each configuration was drawn less than
+        ``max_repetitions`` times, ``repetitions`` being counts per action id."""
+        return repetitions[self.first_id[self._ranks(ranks)]] < max_repetitions
+
+    def new_repetitions(self):
+        return np.zeros(len(self.vocabularies["ids"].bits), dtype=np.int64)
+
+    def next_admissible(self, start, repetitions, max_repetitions, constraints=None):
+        """First rank from ``start`` on, wrapping around, whose first action is
+        below ``max_repetitions`` and which meets ``constraints`` (a mask over
+        the ranks, see ``satisfies``), and the number of ranks skipped to
+        reach it."""
+        size = len(self.first_id)
+        candidates = (start + np.arange(size)) % size
+        admissible = self.below_max_repetitions(
+            repetitions, max_repetitions, candidates
+        )
+        if constraints is not None:
+            admissible &= constraints[candidates]
+        if not admissible.any():
+            raise ValueError(
+                f"No configuration is below {max_repetitions} repetitions "
+                f"and meets the constraints"
+            )
+        skipped = int(np.argmax(admissible))
+        return int(candidates[skipped]), skipped
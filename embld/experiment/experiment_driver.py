@@ -1,9 +1,6 @@
-from collections import defaultdict
-import itertools
 import json
 import logging
 from pathlib import Path
-from random import sample
 import random
 import numpy as np
 
@@ -12,11 +9,16 @@ from PyQt5.QtCore import QObject, pyqtSignal
 from tqdm import trange
 
 from embld.configuration import APP_PARAMETERS
-from embld.experiment.action_parser import generate_actions
+from embld.experiment.action_parser import pending_action_variant
+from embld.experiment.catalogue import catalogue_hash, load_catalogue
+from embld.experiment.configuration_space import ConfigurationSpace
+from embld.experiment.constraints import ConstraintEngine
+from embld.experiment.plan_cache import load_plan, plan_path, save_plan
+from embld.experiment.playback import CuePlayer, create_playback_sink
 from embld.experiment.protocol_simulation import ProtocolSimulationThread
 from embld.experiment.sound_generator import SoundGenerationThread
-from embld.experiment.utils import subject_string_global
-from util.timer import TimerEventThread
+from embld.experiment.utils import sampling_seed, subject_string_global
+from util.timer import ProtocolClock
 
 from PyQt5.QtCore import QThread
 
@@ -25,73 +27,6 @@ from PyQt5.QtCore import QThread
 logger = logging.getLogger()
 
 
-def _all_different(item) -> bool:
-    return (len(item) != 2 or item[0]["id"] != item[1]["id"]) and (
-        len(item) != 3
-        or not item[0]["id"] == item[1]["id"] == item[2]["id"]
-        and item[0]["id"] != item[1]["id"]
-        and item[0]["id"] != item[2]["id"]
-        and item[1]["id"] != item[2]["id"]
-    )
-
-
-def _same_body_parts(action_1, action_2):
-    body_parts_1 = []
-    body_parts_2 = []
-    if action_1["type"] == "atomic":
-        if "body_parts" in action_1:
-            body_parts_1.extend(action_1["body_parts"])
-    else:
-        if "body_parts_0" in action_1:
-            body_parts_1.extend(action_1["body_parts_0"])
-        if "body_parts_1" in action_1:
-            body_parts_1.extend(action_1["body_parts_1"])
-
-    if action_2["type"] == "atomic":
-        if "body_parts" in action_2:
-            body_parts_2.extend(action_2["body_parts"])
-    else:
-        if "body_parts_0" in action_2:
-            body_parts_2.extend(action_2["body_parts_0"])
-        if "body_parts_1" in action_2:
-            body_parts_2.extend(action_2["body_parts_1"])
-
-    body_parts_1 = set(body_parts_1)
-    body_parts_2 = set(body_parts_2)
-    if not body_parts_1 or not body_parts_2:
-        return True
-    return (
-        body_parts_1.issubset(body_parts_2)
-        or body_parts_2.issubset(body_parts_1)
-        or body_parts_2 == body_parts_1
-    )
-
-
-def _successive_actions_key(action_tuple):
-    return "_then_".join([action["id"] for action in action_tuple])
-
-
-def _max_repetitions_reached(action, repetitions, max_repetitions):
-    if action["type"] == "atomic":
-        return repetitions[action["id"]] >= max_repetitions
-    # The code is checking if the number of repetitions of the first element in the list
-    # "constituents" is greater than or equal to a certain maximum value "max_repetitions". If it is,
-    # then the function returns True.
-    constituents = action["constituents"]
-    if repetitions[constituents[0]] >= max_repetitions:
-        return True
-
-
-def _update_repetitions(action, repetitions):
-    if action["type"] == "atomic":
-        repetitions[action["id"]] += 1
-    else:
-        constituents = action["constituents"]
-        repetitions[constituents[0]] += 1
-
-    return repetitions
-
-
 class EMBLDAcquisitionDriver(QObject):
     sync_signal = pyqtSignal(str)
 
@@ -104,8 +39,13 @@ class EMBLDAcquisitionDriver(QObject):
         self.__composition_types = APP_PARAMETERS["composition_types"]
         self.__time_factor = 0.1
         self.__sounds = {}
-        self.timer_thread = None
+        self.clock = None
+        self.catalogue = None
+        self.catalogue_hash = None
+        self.sampled_indices = []
+        self.sampled_rand_values = []
         self.protocol = None
+        self.sound_generator = None
         self.recorder_threads = {}
 
     def generate_configurations(
@@ -113,41 +53,20 @@ class EMBLDAcquisitionDriver(QObject):
     ):
         if include_successions is None:
             include_successions = [2, 3]
-        generated_actions = generate_actions()
-
-        self.generated_configurations = []
-
-        for current_succession_len in include_successions:
-
-            if symmetric_combinations:
-                prod = list(
-                    itertools.combinations(generated_actions, current_succession_len)
-                )
-                prod.extend(reversed(prod.copy()))
-            else:
-                prod_input = [generated_actions for _ in range(current_succession_len)]
-                prod = itertools.product(*prod_input)
-
-            prod = [item for item in prod if _all_different(item)]
-            for item in prod:
-                key = _successive_actions_key(item)
-                self.__actions[key] = {
-                    "id": key,
-                    "type": "composite",
-                    "composition_type": "successive",
-                    "constituents": [action["id"] for action in item],
-                }
-
-        generated_actions = generate_actions()
-        self.generated_configurations = [
-            action
-            for action in generated_actions
-            if action["type"] == "atomic"
-            or (
-                action["type"] == "composite"
-                and action["composition_type"] == "successive"
-            )
-        ]
+        # Successions are only expanded into variants when drawn
+        self.generated_configurations = ConfigurationSpace.from_actions(
+            self.__actions, include_successions, symmetric_combinations
+        )
+        self.close()
+        self.catalogue_hash = catalogue_hash(
+            APP_PARAMETERS, include_successions, symmetric_combinations
+        )
+        self.catalogue = load_catalogue(
+            APP_PARAMETERS,
+            self.generated_configurations,
+            include_successions,
+            symmetric_combinations,
+        )
 
         return len(self.generated_configurations)
 
@@ -185,7 +104,8 @@ class EMBLDAcquisitionDriver(QObject):
         exclusion_list=None,
         sampling_criteria=None,
     ):
-        random.seed(seed)
+        # Draws only consume this generator, the plan only depends on the seed
+        rng = random.Random(seed)
 
         # max_repetitions = APP_PARAMETERS["max_repetitions"]
 
@@ -219,36 +139,29 @@ class EMBLDAcquisitionDriver(QObject):
                     "max_repetitions": 5,
                 },
             ]
-        configurations = self.generated_configurations.copy()
-        configurations = [
-            configuration
-            for configuration in configurations
-            if configuration["id"] not in exclusion_list
-        ]
+        configurations = self.generated_configurations.subspace(
+            lambda configuration: configuration["id"] not in exclusion_list
+        )
         sampled_configurations = []
         filtered_configurations_to_sample = {}
 
         filtered_configurations_to_pick_by_subset_order = []
         filtered_configurations_to_pick_by_subset_order_criteria = []
         for criterion in sampling_criteria:
-            criterion_configurations = [
-                configuration
-                for configuration in configurations
-                if criterion["condition"](configuration)
-            ]
+            criterion_configurations = configurations.subspace(criterion["condition"])
             if criterion["strategy"] == "exhaustive":
-                sampled_configurations.extend(criterion_configurations)
+                sampled_configurations.extend(
+                    criterion_configurations.root_rank(index)
+                    for index in range(len(criterion_configurations))
+                )
             else:
                 if "modalities" in criterion and "unique" in criterion["modalities"]:
                     unique_ids = {
-                        configuration["id"]
-                        for configuration in criterion_configurations
+                        action["id"] for action in criterion_configurations.actions
                     }
-                    criterion_configurations = [
-                        configuration
-                        for configuration in criterion_configurations
-                        if configuration["id"] in unique_ids
-                    ]
+                    criterion_configurations = criterion_configurations.subspace(
+                        lambda configuration: configuration["id"] in unique_ids
+                    )
 
                 if criterion["strategy"] == "sample":
                     filtered_configurations_to_sample[
@@ -266,7 +179,12 @@ class EMBLDAcquisitionDriver(QObject):
         draws_left = number - len(sampled_configurations)
         items_left = len(filtered_configurations_to_sample)
         for filtered_configurations in filtered_configurations_to_sample.values():
-            sampled = sample(filtered_configurations, int(draws_left / items_left))
+            sampled = [
+                filtered_configurations.root_rank(rank)
+                for rank in rng.sample(
+                    range(len(filtered_configurations)), int(draws_left / items_left)
+                )
+            ]
             draws_left -= len(sampled)
             items_left -= 1
 
@@ -278,7 +196,6 @@ class EMBLDAcquisitionDriver(QObject):
         for filtered_configurations_index in range(
             len(filtered_configurations_to_pick_by_subset_order)
         ):
-            repetition_dict = defaultdict(int)
             filtered_configurations = filtered_configurations_to_pick_by_subset_order[
                 filtered_configurations_index
             ]
@@ -287,32 +204,70 @@ class EMBLDAcquisitionDriver(QObject):
             skip = filtered_configurations_to_pick_by_subset_order_criteria[
                 filtered_configurations_index
             ]["skip"]
-            max_repetitions = filtered_configurations_to_pick_by_subset_order_criteria[
+            criterion = filtered_configurations_to_pick_by_subset_order_criteria[
                 filtered_configurations_index
-            ]["max_repetitions"]
+            ]
+            max_repetitions = criterion["max_repetitions"]
+            engine = ConstraintEngine(filtered_configurations)
+            repetitions = engine.new_repetitions()
             next_index = order_subset_number
             sampled = []
+            rank = None
+            # Ranks whose first action reached max_repetitions, or that break the
+            # constraints of the criterion, are skipped on the precompiled masks,
+            # only the picked ranks are expanded
             while number_of_items > 0:
-                sample = filtered_configurations[
-                    next_index % len(filtered_configurations)
-                ]
-
-                while _max_repetitions_reached(
-                    sample, repetition_dict, max_repetitions
-                ):
-                    next_index += 1
-                    sample = filtered_configurations[
-                        next_index % len(filtered_configurations)
-                    ]
-                repetition_dict = _update_repetitions(sample, repetition_dict)
-                sampled.append(sample)
+                rank, skipped = engine.next_admissible(
+                    next_index % len(filtered_configurations),
+                    repetitions,
+                    max_repetitions,
+                    engine.satisfies(criterion, previous=rank),
+                )
+                next_index += skipped
+                repetitions[engine.first_id[rank]] += 1
+                sampled.append(filtered_configurations.root_rank(rank))
                 next_index += skip
                 number_of_items -= 1
             draws_left -= len(sampled)
             items_left -= 1
             sampled_configurations.extend(sampled)
 
-        return sampled_configurations
+        # Configurations are sampled as catalogue indices, expanded only here.
+        # Their rand parameters are drawn from the seed too, so that the
+        # indices and values are enough to render the plan again
+        rand_rng = random.Random(f"{seed}:rand")
+        self.sampled_indices = sampled_configurations
+        self.sampled_rand_values = [
+            self.draw_rand_values(index, rand_rng) for index in sampled_configurations
+        ]
+        return self.configurations_at(self.sampled_indices, self.sampled_rand_values)
+
+    def _pending_variant(self, index):
+        action_index, variant = self.generated_configurations.locate(index)
+        return pending_action_variant(
+            self.generated_configurations.actions[action_index], variant
+        )
+
+    def draw_rand_values(self, index, rng=None):
+        if self.catalogue is not None:
+            return self.catalogue.draw(index, rng)
+        return self._pending_variant(index).draw(rng)
+
+    def configuration_at(self, index, rand_values=None):
+        if self.catalogue is not None:
+            return self.catalogue.configuration(index, rand_values)
+        return self._pending_variant(index).render(rand_values)
+
+    def configurations_at(self, indices, rand_values):
+        return [
+            self.configuration_at(index, values)
+            for index, values in zip(indices, rand_values)
+        ]
+
+    def close(self):
+        if self.catalogue is not None:
+            self.catalogue.close()
+            self.catalogue = None
 
     def next_step(self):
         self.protocol.next_trial()
@@ -335,30 +290,61 @@ class EMBLDAcquisitionDriver(QObject):
         if recorders is None:
             recorders = {}
 
-        seed = hash(metadata["id"]) + hash(metadata["session"])
+        seed = sampling_seed(metadata)
 
         env = simpy.rt.RealtimeEnvironment(factor=0.1)
-        self.timer_thread = TimerEventThread()
+        self.clock = ProtocolClock(APP_PARAMETERS.get("ui_clock_rate", 20))
         if len(self.generated_configurations) == 0:
             logger.info("Generating configurations...")
             self.generate_configurations()
         sample_value = APP_PARAMETERS["sample"]
-        if isinstance(sample_value, float):
-            configurations = self.sample_configurations_ratio(
-                sample_value, seed, order_subset_number=metadata["configuration"]
+        sampled_plan_path = plan_path(
+            APP_PARAMETERS, seed, self.catalogue_hash, sample_value
+        )
+        # A resumed session replays the plan, and instructions, it started with
+        plan = load_plan(sampled_plan_path) if resume else None
+        if plan is not None:
+            self.sampled_indices = plan["indices"]
+            self.sampled_rand_values = plan["rand_values"]
+            configurations = self.configurations_at(
+                self.sampled_indices, self.sampled_rand_values
             )
         else:
-            configurations = self.sample_configurations(
-                sample_value, seed, order_subset_number=metadata["configuration"]
+            if isinstance(sample_value, float):
+                configurations = self.sample_configurations_ratio(
+                    sample_value, seed, order_subset_number=metadata["configuration"]
+                )
+            else:
+                configurations = self.sample_configurations(
+                    sample_value, seed, order_subset_number=metadata["configuration"]
+                )
+            save_plan(
+                sampled_plan_path,
+                seed,
+                self.catalogue_hash,
+                self.sampled_indices,
+                self.sampled_rand_values,
             )
 
+        player = CuePlayer(
+            create_playback_sink(
+                APP_PARAMETERS.get("cue_sink", "sounddevice"),
+                path=Path(
+                    APP_PARAMETERS["base_output_path"],
+                    f"{subject_string_global(metadata)}-cues.wav",
+                ),
+            )
+        )
         self.protocol = ProtocolSimulationThread(
-            env, configurations, self.timer_thread, resume=resume
+            env, configurations, self.clock, resume=resume, player=player
         )
 
-        generator = SoundGenerationThread(configurations, self.protocol)
-        generator.start()
-        generator.wait(3000)
+        # The protocol waits for the sound of each step, no need to block here
+        # Steps skipped by a resumed session need no sound
+        self.sound_generator = SoundGenerationThread(
+            configurations[resume - 1 :] if resume else configurations, self.protocol
+        )
+        self.sound_generator.start()
 
         base_output_path = APP_PARAMETERS["base_output_path"]
         Path(base_output_path).mkdir(exist_ok=True)
@@ -370,12 +356,21 @@ class EMBLDAcquisitionDriver(QObject):
         with open(actions_metadata_path, "w") as fp:
             json.dump(configurations, fp, indent=4)
 
-        actions_metadata_path_full = Path(
+        # The indices and rand values of the plan render these instructions
+        # again from the catalogue
+        actions_index_path = Path(
             Path(base_output_path),
-            f"{subject_string_global(metadata)}-actions_full.json",
+            f"{subject_string_global(metadata)}-actions_index.json",
         )
-        with open(actions_metadata_path_full, "w") as fp:
-            json.dump(self.generated_configurations, fp, indent=4)
+        with open(actions_index_path, "w") as fp:
+            json.dump(
+                {
+                    "catalogue": self.catalogue_hash,
+                    "indices": self.sampled_indices,
+                    "rand_values": self.sampled_rand_values,
+                },
+                fp,
+            )
 
         self.recorder_threads = {}
         for recorder_name in recorders:
@@ -397,14 +392,14 @@ class EMBLDAcquisitionDriver(QObject):
 
         self.sync_signal.connect(protocol_ready)
 
-        self.timer_thread.connect_timer_signal(timer_slot)
+        self.clock.connect_timer_signal(timer_slot)
         self.protocol.connect_status_label_signal(status_label_slot)
 
         self.protocol.connect_wait_for_next_signal(waiting_next_slot)
 
-        logger.info("Starting protocol and timer threads...")
+        logger.info("Starting protocol thread and clock...")
         self.protocol.start()
-        self.timer_thread.start()
+        self.clock.start()
         for recorder_thread in self.recorder_threads.values():
             recorder_thread.start()
 
@@ -432,8 +427,9 @@ class EMBLDAcquisitionDriver(QObject):
         self.sync_signal.emit("sync")
 
     def stop_threads(self):
-        self.timer_thread.exit()
+        self.clock.exit()
         self.protocol.exit()
+        self.protocol.player.close()
 
     def end_experiment(self):
         self.stop_threads()
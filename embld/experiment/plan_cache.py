@@ -0,0 +1,52 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger("Plan Cache")
+
+
+def plan_path(parameters, seed, catalogue_hash, sample):
+    """Path of the plan sampled with ``seed`` from a catalogue, for a sample
+    size or ratio; any change to either yields another plan.
+
+    Plans are kept out of the recordings, which postprocessing walks.
+    """
+    directory = parameters.get("plan_location") or Path("resources", "plans")
+    digest = hashlib.sha1(f"{seed}\0{catalogue_hash}\0{sample}".encode("utf-8"))
+    return Path(directory, f"{digest.hexdigest()}.json")
+
+
+def load_plan(path):
+    """Sampled plan stored at ``path``, None if there is none."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r") as fp:
+            plan = json.load(fp)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable plan {path}: {e}")
+        return None
+    logger.info(f"Reusing the {len(plan['indices'])} configurations of {path}")
+    return plan
+
+
+def save_plan(path, seed, catalogue_hash, indices, rand_values):
+    """Stores a sampled plan, with its drawn rand values so that the same
+    instructions, and their cached sounds, are found again."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = path.with_name(f"{path.name}.partial")
+    with open(partial_path, "w") as fp:
+        json.dump(
+            {
+                "seed": seed,
+                "catalogue": catalogue_hash,
+                "indices": indices,
+                "rand_values": rand_values,
+            },
+            fp,
+        )
+    os.replace(partial_path, path)
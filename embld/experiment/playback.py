@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+from util.timer import now_absolute
+
+logger = logging.getLogger("Cue Playback")
+
+
+def decode_cue(path, sampling_rate, channels):
+    """Decodes an audio file to 16 bit PCM frames at the rate of the sink."""
+    import pydub
+
+    segment = (
+        pydub.AudioSegment.from_file(str(path))
+        .set_frame_rate(sampling_rate)
+        .set_channels(channels)
+        .set_sample_width(2)
+    )
+    return np.frombuffer(segment.raw_data, dtype="<i2").reshape(-1, channels)
+
+
+class NullSink:
+    """Discards the cues, optionally waiting as long as they would play."""
+
+    def __init__(self, sampling_rate=44100, channels=2, realtime=True):
+        self.sampling_rate = sampling_rate
+        self.channels = channels
+        self.realtime = realtime
+        self.latency = 0.0
+
+    def write(self, frames):
+        """Plays ``frames``, returns their onset on the ``now_absolute`` clock."""
+        onset = now_absolute()
+        if self.realtime:
+            time.sleep(len(frames) / self.sampling_rate)
+        return onset
+
+    def close(self):
+        pass
+
+
+class FileSink(NullSink):
+    """Appends every played cue to a wav file, for headless runs."""
+
+    def __init__(self, path, sampling_rate=44100, channels=2, realtime=False):
+        super().__init__(sampling_rate, channels, realtime)
+        self.path = Path(path)
+        self._file = wave.open(str(self.path), "wb")
+        self._file.setnchannels(channels)
+        self._file.setsampwidth(2)
+        self._file.setframerate(sampling_rate)
+
+    def write(self, frames):
+        self._file.writeframes(frames.tobytes())
+        return super().write(frames)
+
+    def close(self):
+        self._file.close()
+
+
+class SoundDeviceSink:
+    """Persistent callback stream on the default audio device.
+
+    The stream is opened once so playing a cue only costs handing the
+    already decoded frames to the callback, which reports the DAC time at
+    which the first frame of the cue is output.
+    """
+
+    def __init__(self, sampling_rate=44100, channels=2, latency="low"):
+        import sounddevice
+
+        self.sampling_rate = sampling_rate
+        self.channels = channels
+        self.lock = threading.Lock()
+        self.cue = None
+        self.position = 0
+        self.onset_dac_time = None
+        self.played = threading.Event()
+        self.stream = sounddevice.OutputStream(
+            samplerate=sampling_rate,
+            channels=channels,
+            dtype="int16",
+            latency=latency,
+            callback=self._callback,
+        )
+        self.stream.start()
+        self.latency = self.stream.latency
+
+    def _callback(self, outdata, frames, time_info, status):
+        with self.lock:
+            if self.cue is None:
+                outdata.fill(0)
+                return
+            if self.position == 0:
+                self.onset_dac_time = time_info.outputBufferDacTime
+            chunk = self.cue[self.position : self.position + frames]
+            outdata[: len(chunk)] = chunk
+            outdata[len(chunk) :] = 0
+            self.position += len(chunk)
+            if self.position >= len(self.cue):
+                self.cue = None
+                self.played.set()
+
+    def write(self, frames):
+        """Blocks until the callback took the last frame of the cue, returns
+        the onset of its first frame on the ``now_absolute`` clock."""
+        # Reference pair relating the stream clock to now_absolute
+        stream_time, absolute_time = self.stream.time, now_absolute()
+        with self.lock:
+            self.played.clear()
+            self.position = 0
+            self.cue = frames
+        if not self.played.wait(len(frames) / self.sampling_rate + 1.0):
+            logger.warning("The audio stream stopped consuming the cue")
+            with self.lock:
+                self.cue = None
+            return absolute_time
+        return absolute_time + (self.onset_dac_time - stream_time) * 1000.0
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+
+def create_playback_sink(name, sampling_rate=44100, channels=2, path=None):
+    if name == "sounddevice":
+        try:
+            return SoundDeviceSink(sampling_rate, channels)
+        except Exception as e:
+            # ImportError without the package, OSError without PortAudio and
+            # PortAudioError without an output device; the protocol keeps its
+            # pace with a silent sink rather than stopping
+            logger.error(
+                f"Cues cannot be played on the audio device ({e}), they are "
+                f"discarded instead: pip install sounddevice"
+            )
+            return NullSink(sampling_rate, channels)
+    if name == "null":
+        return NullSink(sampling_rate, channels)
+    if name == "file":
+        return FileSink(path or "cues.wav", sampling_rate, channels)
+    raise ValueError(f"Unknown cue sink {name}, expected sounddevice, null or file")
+
+
+class CuePlayer:
+    """Plays the protocol cues from PCM buffers decoded ahead of time.
+
+    ``play`` blocks until the cue has been handed to the sink, like the mpg123
+    calls it replaces, and returns the onset the sink measured on the
+    ``now_absolute`` clock, None if the cue could not be decoded.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.cues = {}
+        self.lock = threading.Lock()
+        self.onsets = []
+
+    def preload(self, path):
+        with self.lock:
+            if path in self.cues:
+                return self.cues[path]
+        frames = decode_cue(path, self.sink.sampling_rate, self.sink.channels)
+        with self.lock:
+            self.cues[path] = frames
+        return frames
+
+    def play(self, path):
+        with self.lock:
+            frames = self.cues.get(path)
+        if frames is None:
+            logger.warning(f"{path} was not preloaded, decoding it before playing")
+            try:
+                frames = self.preload(path)
+            except Exception as e:
+                # A missing cue must not stop the protocol, as with mpg123 before
+                logger.error(f"Could not play {path}: {e}")
+                return None
+        requested = now_absolute()
+        onset = self.sink.write(frames)
+        self.onsets.append((path, onset))
+        logger.info(
+            f"Cue {Path(path).name} onset at {onset:.1f} ms "
+            f"({onset - requested:.1f} ms output latency)"
+        )
+        return onset
+
+    def close(self):
+        self.sink.close()
@@ -1,36 +1,34 @@
 import logging
-import os
 import threading
 
-from PyQt5.QtCore import QThread, pyqtSignal, QReadWriteLock
+from PyQt5.QtCore import QThread, pyqtSignal
 import debugpy
 
-# from util.playsound import playsound
+from embld.experiment.playback import CuePlayer, NullSink
+from embld.experiment.tts_cache import sound_key
 
 logger = logging.getLogger()
 
 
-def _play(path):
-    os.system(f'mpg123.exe "{path}"')
-
-
 class ProtocolSimulationThread(QThread):
     status_signal = pyqtSignal(str)
     status_signal_label = pyqtSignal(str)
     wait_for_next_signal = pyqtSignal()
     stop_experiment_signal = pyqtSignal()
 
-    def __init__(self, env, steps, timer, resume=None) -> None:
+    def __init__(self, env, steps, timer, resume=None, player=None) -> None:
         super().__init__()
         self.env = env
         self.steps = steps
         self.trial_event = None
         self.ready_event = None
         self.sounds = {}
+        self.failed_sounds = set()
         self.timer = timer
-        self.lock = QReadWriteLock()
+        self.sounds_available = threading.Condition()
         self.post_wait = False
         self.resume = resume
+        self.player = player or CuePlayer(NullSink())
         logger.debug("Protocol: Initializing protocol thread...")
 
     def _steps(self):
@@ -49,21 +47,14 @@ class ProtocolSimulationThread(QThread):
             self.post_wait = False
             self.not_ready()
             self.trial_event.wait(timeout=None)
-            key = (
-                step["instruction"]
-                .lower()
-                .replace(",", "_")
-                .replace(" ", "_")
-                .replace(".", "")
-            )
+            key = sound_key(step["instruction"])
 
-            self.lock.lockForRead()
-            beep_sound = self.sounds["beep"]
-            current_sound = self.sounds[key]
-            self.lock.unlock()
+            beep_sound = self.wait_for_sound("beep")
+            current_sound = self.wait_for_sound(key)
 
             self.wait_for_next_trial()
-            _play(beep_sound)
+            if beep_sound is not None:
+                self.player.play(beep_sound)
 
             logger.debug("Protocol: \tUnlocking...")
             num_segments = 1 if step["type"] == "atomic" else len(step["constituents"])
@@ -72,7 +63,8 @@ class ProtocolSimulationThread(QThread):
             self.status_signal_label.emit(step["instruction"])
             logger.debug(f"Protocol: Playing sound for {step['id']}")
 
-            _play(current_sound)
+            if current_sound is not None:
+                self.player.play(current_sound)
 
             self.ready_event.wait(timeout=None)
             logger.debug(
@@ -116,6 +108,31 @@ class ProtocolSimulationThread(QThread):
         self.stop_experiment_signal.connect(slot)
 
     def add_sound(self, key, value):
-        self.lock.lockForWrite()
-        self.sounds[key] = value
-        self.lock.unlock()
+        # Decoded here, in the sound generation thread, so cues play without delay
+        try:
+            self.player.preload(value)
+        except Exception as e:
+            logger.error(f"Protocol: Could not preload {value}: {e}")
+            self.sound_failed(key)
+            return
+        with self.sounds_available:
+            self.sounds[key] = value
+            self.sounds_available.notify_all()
+
+    def sound_failed(self, key):
+        with self.sounds_available:
+            self.failed_sounds.add(key)
+            self.sounds_available.notify_all()
+
+    def wait_for_sound(self, key):
+        """Blocks the protocol until the sound of the step has been generated."""
+        with self.sounds_available:
+            if key not in self.sounds and key not in self.failed_sounds:
+                logger.info(f"Protocol: Waiting for the sound of {key}...")
+            self.sounds_available.wait_for(
+                lambda: key in self.sounds or key in self.failed_sounds
+            )
+            if key in self.failed_sounds:
+                logger.error(f"Protocol: No sound could be generated for {key}")
+                return None
+            return self.sounds[key]
@@ -1,12 +1,9 @@
-import contextlib
 import logging
-from pathlib import Path
 
 from PyQt5.QtCore import QThread
-from gtts import gTTS
-from tqdm import tqdm
 
 from embld.configuration import APP_PARAMETERS
+from embld.experiment.tts_cache import create_tts_cache, sound_key
 
 logger = logging.getLogger()
 
@@ -14,25 +11,45 @@ logger = logging.getLogger()
 class SoundGenerationThread(QThread):
     def __init__(self, generated_configurations, protocol_instance) -> None:
         super().__init__()
-        logger.info("Initializing time thread...")
+        logger.info("Initializing sound generation thread...")
         self.__generated_configurations = generated_configurations
         self.protocol_instance = protocol_instance
 
+    def _register(self, instruction, future):
+        exception = future.exception()
+        if exception is not None:
+            logger.error(f"Could not synthesize '{instruction}': {exception}")
+            self.protocol_instance.sound_failed(sound_key(instruction))
+        else:
+            self.protocol_instance.add_sound(sound_key(instruction), future.result())
+
     def run(self):
         sound_location = APP_PARAMETERS["sound_location"]
 
-        self.protocol_instance.add_sound("beep", f"{sound_location}/beep.mp3")
-        for configuration in tqdm(
-            self.__generated_configurations, desc="Loading sounds in the background..."
-        ):
-            instruction = configuration["instruction"]
-            hash_key = (
-                instruction.lower().replace(",", "_").replace(" ", "_").replace(".", "")
+        self.protocol_instance.add_sound("beep", f"{sound_location}/beep.wav")
+        # Requested in protocol order so the first steps are ready first
+        instructions = list(
+            dict.fromkeys(
+                configuration["instruction"]
+                for configuration in self.__generated_configurations
+            )
+        )
+        try:
+            cache = create_tts_cache(APP_PARAMETERS)
+        except Exception as e:
+            # The protocol waits for every step's sound, it must learn they failed
+            logger.error(f"Could not set up the instruction sound synthesis: {e}")
+            for instruction in instructions:
+                self.protocol_instance.sound_failed(sound_key(instruction))
+            self.exec_()
+            return
+        for instruction in instructions:
+            cache.request(instruction).add_done_callback(
+                lambda future, instruction=instruction: self._register(
+                    instruction, future
+                )
             )
-            filename = sound_location + str(hash_key) + ".mp3"
-            if not Path(filename).exists():
-                with contextlib.suppress(Exception):
-                    gTTS(configuration["instruction"]).save(filename)
-            self.protocol_instance.add_sound(hash_key, filename)
+        cache.shutdown(wait=True)
+        logger.info(f"{len(instructions)} instruction sounds ready")
 
         self.exec_()
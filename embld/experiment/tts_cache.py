@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+logger = logging.getLogger("TTS Cache")
+
+
+def sound_key(instruction):
+    """Key under which the protocol looks up the sound of an instruction."""
+    return instruction.lower().replace(",", "_").replace(" ", "_").replace(".", "")
+
+
+def normalise_instruction(instruction):
+    """Instructions differing only by case, spacing or punctuation sound the same."""
+    text = re.sub(r"[^\w\s']", " ", instruction.lower())
+    return " ".join(text.split())
+
+
+class GTTSSynthesizer:
+    name = "gtts"
+    extension = "mp3"
+
+    def __init__(self, lang="en"):
+        self.lang = lang
+
+    @property
+    def identity(self):
+        return f"{self.name}:{self.lang}"
+
+    def synthesize(self, text, path):
+        from gtts import gTTS
+
+        gTTS(text, lang=self.lang).save(str(path))
+
+
+class Pyttsx3Synthesizer:
+    """Offline synthesis with the voices installed on the machine."""
+
+    name = "pyttsx3"
+    extension = "wav"
+
+    def __init__(self, voice=None, rate=None):
+        self.voice = voice
+        self.rate = rate
+        # pyttsx3 engines are not thread safe, one synthesis at a time
+        self.lock = threading.Lock()
+
+    @property
+    def identity(self):
+        return f"{self.name}:{self.voice}:{self.rate}"
+
+    def synthesize(self, text, path):
+        import pyttsx3
+
+        with self.lock:
+            engine = pyttsx3.init()
+            if self.voice is not None:
+                engine.setProperty("voice", self.voice)
+            if self.rate is not None:
+                engine.setProperty("rate", self.rate)
+            engine.save_to_file(text, str(path))
+            engine.runAndWait()
+            engine.stop()
+
+
+SYNTHESIZERS = {
+    GTTSSynthesizer.name: GTTSSynthesizer,
+    Pyttsx3Synthesizer.name: Pyttsx3Synthesizer,
+}
+
+
+def create_synthesizer(name, **options):
+    if name not in SYNTHESIZERS:
+        raise ValueError(
+            f"Unknown synthesizer {name}, expected one of {', '.join(SYNTHESIZERS)}"
+        )
+    return SYNTHESIZERS[name](**options)
+
+
+class TTSCache:
+    """Instruction sounds stored under the digest of the synthesizer and text.
+
+    Misses are synthesized by at most ``max_workers`` threads, concurrent
+    requests for the same text share a single synthesis, and files are
+    renamed into place once complete so a crash never leaves a truncated cue.
+    """
+
+    def __init__(self, directory, synthesizer, max_workers=4):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.synthesizer = synthesizer
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="TTS"
+        )
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def path_for(self, instruction):
+        digest = hashlib.sha1(
+            f"{self.synthesizer.identity}\0{normalise_instruction(instruction)}".encode(
+                "utf-8"
+            )
+        ).hexdigest()
+        return Path(self.directory, f"{digest}.{self.synthesizer.extension}")
+
+    def get(self, instruction):
+        path = self.path_for(instruction)
+        return path if path.exists() else None
+
+    def _synthesize(self, instruction, path):
+        partial_path = path.with_name(f"{path.stem}.partial.{path.suffix[1:]}")
+        self.synthesizer.synthesize(instruction, partial_path)
+        os.replace(partial_path, path)
+        logger.debug(f"Synthesized '{instruction}' into {path.name}")
+        return path
+
+    def _done(self, path, future):
+        with self.lock:
+            self.in_flight.pop(path, None)
+
+    def request(self, instruction):
+        """Returns a future of the path of the sound of ``instruction``."""
+        path = self.path_for(instruction)
+        with self.lock:
+            if path in self.in_flight:
+                return self.in_flight[path]
+            if path.exists():
+                future = Future()
+                future.set_result(path)
+                return future
+            future = self.executor.submit(self._synthesize, instruction, path)
+            self.in_flight[path] = future
+        future.add_done_callback(lambda f: self._done(path, f))
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+def create_tts_cache(parameters, synthesizer=None, max_workers=None):
+    tts = parameters.get("tts", {})
+    configured = tts.get("synthesizer", GTTSSynthesizer.name)
+    synthesizer = synthesizer or configured
+    # Backend options only apply to the backend they were configured for
+    options = tts.get("options", {}) if synthesizer == configured else {}
+    return TTSCache(
+        tts.get("cache_location", Path(parameters["sound_location"], "tts")),
+        create_synthesizer(synthesizer, **options),
+        max_workers=max_workers or tts.get("max_workers", 4),
+    )
@@ -1,5 +1,19 @@
+import hashlib
+from pathlib import Path
+
+
 def subject_string_trial(metadata, sequence_id, event_name):
     return f"{sequence_id}-S_{metadata['id']}-R_{metadata['session']}-{event_name}"
 
 def subject_string_global(metadata):
-    return f"S_{metadata['id']}-R_{metadata['session']}"
\ No newline at end of file
+    return f"S_{metadata['id']}-R_{metadata['session']}"
+
+def sampling_seed(metadata):
+    # hash() of strings is salted per process, a digest gives the same seed on every run
+    key = f"{metadata['id']}\0{metadata['session']}\0{metadata['configuration']}"
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+def sync_sidecar_path(data_path):
+    data_path = Path(data_path)
+    return data_path.with_name(f"{data_path.stem}_sync.json")
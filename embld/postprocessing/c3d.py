@@ -0,0 +1,180 @@
+import mmap
+import struct
+from pathlib import Path
+
+_BLOCK_SIZE = 512
+_INTEL_PROCESSOR = 84
+_COPY_BUFFER_SIZE = 1 << 20
+
+
+def _parameters(data, start):
+    """Maps (GROUP, PARAMETER) to (type, dimensions, data offset) of a c3d file."""
+    groups = {}
+    parameters = {}
+    offset = start + 4
+    end = len(data)
+    while offset + 2 <= end:
+        name_length = abs(struct.unpack_from("<b", data, offset)[0])
+        group_id = struct.unpack_from("<b", data, offset + 1)[0]
+        if name_length == 0:
+            break
+        name = bytes(data[offset + 2 : offset + 2 + name_length]).decode(
+            "ascii", "replace"
+        )
+        next_offset_position = offset + 2 + name_length
+        next_offset = struct.unpack_from("<h", data, next_offset_position)[0]
+        cursor = next_offset_position + 2
+        if group_id < 0:
+            groups[-group_id] = name.upper()
+        else:
+            data_type, dimension_count = struct.unpack_from("<bB", data, cursor)
+            dimensions = struct.unpack_from(f"<{dimension_count}B", data, cursor + 2)
+            parameters[(group_id, name.upper())] = (
+                data_type,
+                dimensions,
+                cursor + 2 + dimension_count,
+            )
+        if next_offset == 0:
+            break
+        offset = next_offset_position + next_offset
+    return {
+        (groups.get(group_id, ""), name): value
+        for (group_id, name), value in parameters.items()
+    }
+
+
+def _read_parameter(data, parameter, index=0):
+    data_type, _, offset = parameter
+    if data_type == 2:
+        return struct.unpack_from("<H", data, offset + 2 * index)[0]
+    if data_type == 4:
+        return struct.unpack_from("<f", data, offset + 4 * index)[0]
+    return data[offset + index]
+
+
+def _write_parameter(buffer, parameter, value, index=0, base=0):
+    data_type, _, offset = parameter
+    offset -= base
+    if data_type == 2:
+        struct.pack_into("<H", buffer, offset + 2 * index, value)
+    elif data_type == 4:
+        struct.pack_into("<f", buffer, offset + 4 * index, float(value))
+
+
+def _frame_layout(data):
+    parameter_block = data[0]
+    points, analog_per_frame, first_frame, last_frame = struct.unpack_from(
+        "<HHHH", data, 2
+    )
+    scale = struct.unpack_from("<f", data, 12)[0]
+    data_block = struct.unpack_from("<H", data, 16)[0]
+    parameter_start = (parameter_block - 1) * _BLOCK_SIZE
+    if data[parameter_start + 3] != _INTEL_PROCESSOR:
+        raise ValueError("Only c3d files written for Intel processors can be streamed")
+    value_size = 4 if scale < 0 else 2
+    frame_size = (4 * points + analog_per_frame) * value_size
+    data_start = (data_block - 1) * _BLOCK_SIZE
+    parameters = _parameters(data, parameter_start)
+
+    frame_count = last_frame - first_frame + 1
+    trial_start = parameters.get(("TRIAL", "ACTUAL_START_FIELD"))
+    trial_end = parameters.get(("TRIAL", "ACTUAL_END_FIELD"))
+    if trial_start is not None and trial_end is not None:
+        start = _read_parameter(data, trial_start) + (
+            _read_parameter(data, trial_start, 1) << 16
+        )
+        end = _read_parameter(data, trial_end) + (
+            _read_parameter(data, trial_end, 1) << 16
+        )
+        frame_count = max(frame_count, end - start + 1)
+    elif ("POINT", "FRAMES") in parameters:
+        frame_count = max(
+            frame_count, int(_read_parameter(data, parameters[("POINT", "FRAMES")]))
+        )
+    if frame_size > 0:
+        frame_count = min(frame_count, (len(data) - data_start) // frame_size)
+    return {
+        "first_frame": first_frame,
+        "frame_size": frame_size,
+        "frame_count": frame_count,
+        "parameter_start": parameter_start,
+        "data_start": data_start,
+        "parameters": parameters,
+    }
+
+
+def c3d_sampling_rate(source: Path) -> float:
+    with open(source, "rb") as fp:
+        header = fp.read(24)
+    return struct.unpack_from("<f", header, 20)[0]
+
+
+def _write_range(data, layout, target, start_frame, end_frame):
+    kept = end_frame - start_frame
+    first_frame = layout["first_frame"] + start_frame
+    last_frame = first_frame + kept - 1
+
+    head = bytearray(data[: layout["data_start"]])
+    struct.pack_into(
+        "<HH", head, 6, min(first_frame, 0xFFFF), min(max(last_frame, 0), 0xFFFF)
+    )
+    parameters = layout["parameters"]
+    frames_parameter = parameters.get(("POINT", "FRAMES"))
+    if frames_parameter is not None:
+        _write_parameter(head, frames_parameter, kept)
+    trial_start = parameters.get(("TRIAL", "ACTUAL_START_FIELD"))
+    trial_end = parameters.get(("TRIAL", "ACTUAL_END_FIELD"))
+    if trial_start is not None and trial_end is not None:
+        _write_parameter(head, trial_start, first_frame & 0xFFFF)
+        _write_parameter(head, trial_start, first_frame >> 16, index=1)
+        _write_parameter(head, trial_end, last_frame & 0xFFFF)
+        _write_parameter(head, trial_end, last_frame >> 16, index=1)
+
+    begin = layout["data_start"] + start_frame * layout["frame_size"]
+    end = begin + kept * layout["frame_size"]
+    with open(target, "wb") as out:
+        out.write(head)
+        for position in range(begin, end, _COPY_BUFFER_SIZE):
+            out.write(data[position : min(position + _COPY_BUFFER_SIZE, end)])
+        padding = (end - begin) % _BLOCK_SIZE
+        if padding:
+            out.write(bytes(_BLOCK_SIZE - padding))
+    return kept
+
+
+def split_c3d(source: Path, ranges) -> list[int]:
+    """Writes every (target, start_frame, end_frame) range of ``source``.
+
+    Only the header and the parameter section are read into memory and patched
+    for each output (frame counts in the header, POINT:FRAMES and
+    TRIAL:ACTUAL_*_FIELD); the frames of each range are streamed from a single
+    memory map of the data section. ``end_frame`` may be None for the end of
+    the recording. Returns the number of frames written per range.
+    """
+    with open(source, "rb") as fp, mmap.mmap(
+        fp.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        layout = _frame_layout(data)
+        frame_count = layout["frame_count"]
+        frames_parameter = layout["parameters"].get(("POINT", "FRAMES"))
+        resolved = []
+        for target, start_frame, end_frame in ranges:
+            start_frame = max(0, min(int(start_frame), frame_count))
+            end_frame = frame_count if end_frame is None else int(end_frame)
+            end_frame = max(start_frame, min(end_frame, frame_count))
+            if (
+                frames_parameter is not None
+                and frames_parameter[0] == 2
+                and end_frame - start_frame > 0xFFFF
+            ):
+                raise ValueError("POINT:FRAMES cannot hold the number of frames kept")
+            resolved.append((target, start_frame, end_frame))
+        return [
+            _write_range(data, layout, target, start_frame, end_frame)
+            for target, start_frame, end_frame in resolved
+        ]
+
+
+def cut_c3d(source: Path, target: Path, start_frame: int) -> int:
+    """Writes ``source`` without its first ``start_frame`` frames to ``target``."""
+    return split_c3d(source, [(target, start_frame, None)])[0]
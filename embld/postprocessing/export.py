@@ -0,0 +1,237 @@
+import json
+import re
+from pathlib import Path
+from typing import Optional
+
+_TRIAL_FILE_PATTERN = re.compile(
+    r"^(?P<trial_number>\d+)-S_(?P<subject>.+?)-R_(?P<session>[^-]+)-(?P<action>.+)_mocap\.c3d$"
+)
+_SAMPLED_CONFIGURATIONS_PATTERN = re.compile(
+    r"^S_(?P<subject>.+?)-R_(?P<session>[^-]+)-actions_sampled\.json$"
+)
+INDEX_NAME = "index.parquet"
+
+
+def find_mocap_trials(input_path: Path) -> list[dict]:
+    """Mocap trials recorded under ``input_path`` along with their annotation file."""
+    trials = []
+    for c3d_file in sorted(Path(input_path).rglob("*_mocap.c3d")):
+        match = _TRIAL_FILE_PATTERN.match(c3d_file.name)
+        if match is None:
+            continue
+        annotation_file = c3d_file.with_name(
+            c3d_file.name[: -len("_mocap.c3d")] + "_annotation.json"
+        )
+        trials.append(
+            {
+                "c3d": c3d_file,
+                "annotation": annotation_file if annotation_file.exists() else None,
+                "subject": match["subject"],
+                "session": match["session"],
+                "action": match["action"],
+                "trial_number": int(match["trial_number"]),
+            }
+        )
+    return trials
+
+
+def _configuration_body_parts(configuration) -> list[str]:
+    body_parts = set(configuration.get("body_parts", []))
+    for key, value in configuration.items():
+        if key.startswith("body_parts_"):
+            body_parts.update(value)
+    return sorted(body_parts)
+
+
+def load_body_parts(input_path: Path) -> dict:
+    """Maps (subject, session, action id, instruction) to the body parts involved.
+
+    Body parts are not part of the annotation files, they are recovered from
+    the sampled configurations saved for every session.
+    """
+    body_parts = {}
+    for configurations_file in Path(input_path).rglob("*-actions_sampled.json"):
+        match = _SAMPLED_CONFIGURATIONS_PATTERN.match(configurations_file.name)
+        if match is None:
+            continue
+        with open(configurations_file, "r") as fp:
+            configurations = json.load(fp)
+        for configuration in configurations:
+            key = (
+                match["subject"],
+                match["session"],
+                configuration["id"],
+                configuration["instruction"],
+            )
+            body_parts[key] = _configuration_body_parts(configuration)
+    return body_parts
+
+
+def _segment_per_frame(num_frames, segment_timings, sampling_rate):
+    import numpy as np
+
+    boundaries = np.round(np.asarray(segment_timings) * sampling_rate).astype(int)
+    # -1 before the first sync, i between sync i and i + 1
+    return (
+        np.searchsorted(boundaries, np.arange(num_frames), side="right") - 1
+    ).astype(np.int16)
+
+
+def _trial_table(trial, annotation, segment_indices):
+    import ezc3d
+    import numpy as np
+    import pyarrow as pa
+
+    c3d = ezc3d.c3d(str(trial["c3d"]))
+    points = c3d["data"]["points"]
+    sampling_rate = float(c3d["parameters"]["POINT"]["RATE"]["value"][0])
+    labels = list(c3d["parameters"]["POINT"]["LABELS"]["value"])
+    num_markers, num_frames = points.shape[1], points.shape[2]
+    labels = (labels + [f"marker_{i}" for i in range(len(labels), num_markers)])[
+        :num_markers
+    ]
+
+    if segment_indices:
+        segment_timings = np.asarray(segment_indices) / sampling_rate
+    else:
+        segment_timings = [
+            segment["onset"] for segment in annotation.get("segments", [])
+        ]
+    segments = _segment_per_frame(num_frames, segment_timings, sampling_rate)
+
+    # Rows are (frame, marker) so that every trial shares the same schema
+    frames = np.repeat(np.arange(num_frames, dtype=np.int32), num_markers)
+    markers = pa.DictionaryArray.from_arrays(
+        pa.array(np.tile(np.arange(num_markers, dtype=np.int32), num_frames)),
+        pa.array(labels, pa.string()),
+    )
+    coordinates = points[:3].transpose(2, 1, 0).reshape(-1, 3).astype(np.float32)
+    return pa.table(
+        {
+            "trial_number": pa.array(
+                np.full(len(frames), trial["trial_number"], dtype=np.int32)
+            ),
+            "frame": pa.array(frames),
+            "time": pa.array(frames / sampling_rate),
+            "segment": pa.array(np.repeat(segments, num_markers)),
+            "marker": markers,
+            "x": pa.array(coordinates[:, 0]),
+            "y": pa.array(coordinates[:, 1]),
+            "z": pa.array(coordinates[:, 2]),
+        }
+    ), {"sampling_rate": sampling_rate, "num_frames": num_frames, "markers": labels}
+
+
+def _partition_path(output_path: Path, trial) -> Path:
+    return (
+        Path(output_path)
+        / f"subject={trial['subject']}"
+        / f"session={trial['session']}"
+        / f"action={trial['action']}"
+        / f"trial-{trial['trial_number']}.parquet"
+    )
+
+
+def export_mocap_dataset(
+    input_path: Path, output_path: Path, row_group_size: int = 1 << 16
+) -> int:
+    """Writes the mocap trials under ``input_path`` as a partitioned Parquet dataset.
+
+    Every trial becomes one file under subject=/session=/action=/ with one row
+    per (frame, marker), the annotation segment of each frame as a column and
+    the trial metadata in ``index.parquet`` at the root. Returns the number of
+    trials exported.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from embld.experiment.utils import sync_sidecar_path
+
+    body_parts = load_body_parts(input_path)
+    index_rows = []
+    for trial in find_mocap_trials(input_path):
+        annotation = {}
+        if trial["annotation"] is not None:
+            with open(trial["annotation"], "r") as fp:
+                annotation = json.load(fp)
+        segment_indices = None
+        sidecar = sync_sidecar_path(trial["c3d"])
+        if sidecar.exists():
+            with open(sidecar, "r") as fp:
+                segment_indices = json.load(fp)["segment_sample_indices"]
+
+        table, info = _trial_table(trial, annotation, segment_indices)
+        target = _partition_path(output_path, trial)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, target, row_group_size=row_group_size)
+
+        instruction = annotation.get("instruction") or ""
+        index_rows.append(
+            {
+                "subject": trial["subject"],
+                "session": trial["session"],
+                "action": trial["action"],
+                "trial_number": trial["trial_number"],
+                "instruction": instruction,
+                "body_parts": body_parts.get(
+                    (trial["subject"], trial["session"], trial["action"], instruction),
+                    [],
+                ),
+                "constituents": trial["action"].split("_then_"),
+                "sampling_rate": info["sampling_rate"],
+                "num_frames": info["num_frames"],
+                "markers": info["markers"],
+                "segment_onsets": [
+                    segment["onset"] for segment in annotation.get("segments", [])
+                ],
+                "path": str(target.relative_to(output_path)),
+            }
+        )
+    pq.write_table(pa.Table.from_pylist(index_rows), Path(output_path) / INDEX_NAME)
+    return len(index_rows)
+
+
+def query_trials(
+    output_path: Path,
+    action: Optional[str] = None,
+    body_part: Optional[str] = None,
+    subject: Optional[str] = None,
+    session: Optional[str] = None,
+) -> list[dict]:
+    """Index rows of the exported trials matching every criterion given.
+
+    ``action`` matches any constituent of a succession, ``body_part`` any of the
+    body parts involved (e.g. "right_leg").
+    """
+    import pyarrow.parquet as pq
+
+    rows = pq.read_table(Path(output_path) / INDEX_NAME).to_pylist()
+    return [
+        row
+        for row in rows
+        if (action is None or action in row["constituents"])
+        and (body_part is None or body_part in row["body_parts"])
+        and (subject is None or row["subject"] == subject)
+        and (session is None or row["session"] == session)
+    ]
+
+
+def read_trials(output_path: Path, markers: Optional[list[str]] = None, **criteria):
+    """Marker trajectories of the trials matching ``criteria`` (see query_trials).
+
+    The index is resolved first, so only the files of the matching trials are
+    opened; ``markers`` restricts the rows returned to those markers.
+    """
+    import pyarrow.dataset as ds
+
+    trials = query_trials(output_path, **criteria)
+    if not trials:
+        return None
+    dataset = ds.dataset(
+        [str(Path(output_path) / trial["path"]) for trial in trials],
+        format="parquet",
+        partitioning="hive",
+        partition_base_dir=str(output_path),
+    )
+    expression = None if markers is None else ds.field("marker").isin(markers)
+    return dataset.to_table(filter=expression)
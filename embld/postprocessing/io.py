@@ -1,13 +1,51 @@
+import json
 from pathlib import Path
 
+from embld.experiment.utils import sync_sidecar_path
+
 
 def recurse_downwards_input_hierarchy(path: Path):
     leaf_directories = []
     if path.is_dir():
-        children = list(path.iterdir())
-        if children[0].is_dir():
+        # Dot directories hold acquisition state such as the chunk spool
+        children = [child for child in path.iterdir() if not child.name.startswith(".")]
+        if any(child.is_file() for child in children):
+            leaf_directories.append(path)
+        else:
             for child in children:
                 leaf_directories.extend(recurse_downwards_input_hierarchy(child))
-        else:
-            leaf_directories.append(path)
-    return leaf_directories
\ No newline at end of file
+    return leaf_directories
+
+
+def segment_file_name(data_file: Path, position: int) -> str:
+    return f"{data_file.stem}_segment{position}{data_file.suffix}"
+
+
+def read_sync_sidecar(data_file: Path):
+    sidecar = sync_sidecar_path(data_file)
+    if not sidecar.exists():
+        return None
+    with open(sidecar, "r") as fp:
+        return json.load(fp)
+
+
+def write_cut_sync_sidecar(
+    data_file: Path, sampling_rate, start_sample, encoder_delay, boundaries
+) -> None:
+    """Writes where a cut file starts in its source next to it.
+
+    ``start_sample`` is the source sample the cut file actually starts at,
+    which precedes the requested cut when it is aligned on mp3 frames, and
+    ``boundaries`` the source samples of its segment boundaries, stored
+    relative to that start as ``segment_sample_indices``.
+    """
+    sync = {
+        "sampling_rate": sampling_rate,
+        "source_start_sample": int(start_sample),
+        "encoder_delay": int(encoder_delay),
+        "segment_sample_indices": [
+            int(boundary) - int(start_sample) for boundary in boundaries
+        ],
+    }
+    with open(sync_sidecar_path(data_file), "w") as fp:
+        json.dump(sync, fp)
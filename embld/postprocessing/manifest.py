@@ -0,0 +1,109 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: Path, with_digest: bool = True) -> dict:
+    stat = Path(path).stat()
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if with_digest:
+        fingerprint["sha256"] = file_digest(path)
+    return fingerprint
+
+
+class RazorManifest:
+    """Append-only JSON-lines log of the files a razor run has processed.
+
+    Every finished item is appended and flushed immediately, so a run that
+    crashes can be restarted and will skip what is already in the manifest.
+    Entries keep the size, mtime and content hash of the input along with the
+    segment timings it was cut with: an input is only cut again when one of
+    them changed or its output disappeared. Size and mtime are checked first,
+    the content is only hashed again when the mtime moved (e.g. after a copy),
+    after which the new mtime is recorded.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, "r") as fp:
+                for line in fp:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        self.entries[entry["file"]] = entry
+
+    def is_done(self, key: str) -> bool:
+        return key in self.entries and self.entries[key]["status"] == "done"
+
+    def is_up_to_date(
+        self,
+        key: str,
+        file: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
+        output: Optional[Path] = None,
+    ) -> bool:
+        if not self.is_done(key):
+            return False
+        entry = self.entries[key]
+        if (
+            entry.get("segment_timings") != list(segment_timings)
+            or entry.get("segment_indices") != segment_indices
+        ):
+            return False
+        if output is not None and not Path(output).exists():
+            return False
+        fingerprint = file_fingerprint(file, with_digest=False)
+        if fingerprint["size"] != entry.get("size"):
+            return False
+        if fingerprint["mtime"] == entry.get("mtime"):
+            return True
+        if file_digest(file) != entry.get("sha256"):
+            return False
+        # Same content under a new mtime, remember it so it is not hashed again
+        fields = {
+            name: value
+            for name, value in entry.items()
+            if name not in ("file", "status")
+        }
+        fields["mtime"] = fingerprint["mtime"]
+        self.record(key, entry["status"], **fields)
+        return True
+
+    def record(self, key: str, status: str, error: str = None, **fields) -> None:
+        entry = {"file": key, "status": status, **fields}
+        if error is not None:
+            entry["error"] = error
+        self.entries[key] = entry
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps(entry) + "\n")
+
+    def record_cut(
+        self,
+        key: str,
+        file: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
+        fingerprint: Optional[dict] = None,
+    ) -> None:
+        self.record(
+            key,
+            "done",
+            segment_timings=list(segment_timings),
+            segment_indices=segment_indices,
+            **(fingerprint or file_fingerprint(file)),
+        )
@@ -0,0 +1,205 @@
+import shutil
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+
+_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+_VERSIONS = {0: 2.5, 2: 2, 3: 1}
+_LAYERS = {1: 3, 2: 2, 3: 1}
+_COPY_BUFFER_SIZE = 1 << 20
+# Xing/Info fields present for each flag bit: frames, bytes, toc and quality
+_XING_FIELDS = ((0x01, 4), (0x02, 4), (0x04, 100), (0x08, 4))
+# Offset of the 12 bit encoder delay in the LAME extension of the Xing/Info tag
+_LAME_DELAY_OFFSET = 21
+# Samples an mp3 decoder outputs on its own, on top of the encoder delay
+DECODER_DELAY = 529
+# Delay of LAME with its default settings, when a file carries no LAME tag
+DEFAULT_ENCODER_DELAY = 576 + DECODER_DELAY
+
+
+def _parse_header(header: bytes):
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = _VERSIONS.get((header[1] >> 3) & 0x03)
+    layer = _LAYERS.get((header[1] >> 1) & 0x03)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15):
+        return None
+    if sample_rate_index == 3:
+        return None
+    bitrate = _BITRATES[(min(version, 2), layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (header[2] >> 1) & 0x01
+    if layer == 1:
+        samples, length = 384, (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and version != 1:
+        samples, length = 576, 72 * bitrate // sample_rate + padding
+    else:
+        samples, length = 1152, 144 * bitrate // sample_rate + padding
+    mono = (header[3] >> 6) == 3
+    if version == 1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    crc = 0 if header[1] & 0x01 else 2
+    return {
+        "sample_rate": sample_rate,
+        "samples": samples,
+        "length": length,
+        "tag_offset": 4 + crc + side_info,
+    }
+
+
+def _id3v2_size(fp) -> int:
+    fp.seek(0)
+    header = fp.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def iter_frames(fp):
+    """Yields (offset, header) for every mpeg audio frame without decoding.
+
+    The first frame is skipped when it is a Xing/Info tag rather than audio.
+    Garbage between frames is skipped by resynchronising on the next valid
+    header.
+    """
+    offset = _id3v2_size(fp)
+    first = True
+    while True:
+        fp.seek(offset)
+        header = _parse_header(fp.read(4))
+        if header is None:
+            fp.seek(offset)
+            window = fp.read(_COPY_BUFFER_SIZE)
+            if len(window) < 4 or window[:3] == b"TAG":
+                return
+            sync = window.find(b"\xff", 1)
+            if sync == -1:
+                offset += len(window)
+            else:
+                offset += sync
+            continue
+        if first:
+            first = False
+            fp.seek(offset + header["tag_offset"])
+            if fp.read(4) in (b"Xing", b"Info"):
+                offset += header["length"]
+                continue
+        yield offset, header
+        offset += header["length"]
+
+
+def _frame_table(fp):
+    offsets = []
+    starts = []
+    position = 0
+    sample_rate = None
+    for offset, header in iter_frames(fp):
+        offsets.append(offset)
+        starts.append(position)
+        position += header["samples"]
+        sample_rate = sample_rate or header["sample_rate"]
+    return offsets, starts, sample_rate
+
+
+def _copy_range(fp, out, begin, end=None):
+    fp.seek(begin)
+    if end is None:
+        shutil.copyfileobj(fp, out, _COPY_BUFFER_SIZE)
+        return
+    left = end - begin
+    while left > 0:
+        block = fp.read(min(left, _COPY_BUFFER_SIZE))
+        if not block:
+            break
+        out.write(block)
+        left -= len(block)
+
+
+def mp3_sampling_rate(source: Path) -> int:
+    with open(source, "rb") as fp:
+        for _, header in iter_frames(fp):
+            return header["sample_rate"]
+    raise ValueError(f"No mpeg audio frame found in {str(source)}")
+
+
+def encoder_delay(source: Path) -> int:
+    """Number of samples decoded from ``source`` before its first encoded one.
+
+    Read from the LAME extension of the Xing/Info tag, the LAME default is
+    assumed when the file has none.
+    """
+    with open(source, "rb") as fp:
+        offset = _id3v2_size(fp)
+        fp.seek(offset)
+        header = _parse_header(fp.read(4))
+        if header is None:
+            return DEFAULT_ENCODER_DELAY
+        fp.seek(offset + header["tag_offset"])
+        if fp.read(4) not in (b"Xing", b"Info"):
+            return DEFAULT_ENCODER_DELAY
+        flags = int.from_bytes(fp.read(4), "big")
+        fp.seek(sum(size for flag, size in _XING_FIELDS if flags & flag), 1)
+        extension = fp.read(_LAME_DELAY_OFFSET + 3)
+    if len(extension) < _LAME_DELAY_OFFSET + 3 or not any(extension[:9]):
+        return DEFAULT_ENCODER_DELAY
+    delay = extension[_LAME_DELAY_OFFSET:]
+    return ((delay[0] << 4) | (delay[1] >> 4)) + DECODER_DELAY
+
+
+def split_mp3(source: Path, ranges, delay: int = 0) -> list[int]:
+    """Copies the mp3 frames of every (target, start_sample, end_sample) range.
+
+    The frame headers are walked once for all ranges and no frame is decoded or
+    re-encoded, so cuts are aligned on frame boundaries (1152 samples at 48kHz,
+    24ms): each output starts with the frame holding its start sample and ends
+    with the frame holding its last sample. ``end_sample`` may be None for the
+    end of the file. ``delay`` is the number of samples the encoder prepended
+    to the ones the ranges refer to. Returns the sample at which each output
+    actually starts.
+    """
+    actual_starts = []
+    with open(source, "rb") as fp:
+        tag_size = _id3v2_size(fp)
+        offsets, starts, _ = _frame_table(fp)
+        fp.seek(0)
+        tag = fp.read(tag_size)
+        for target, start_sample, end_sample in ranges:
+            first = max(bisect_right(starts, start_sample + delay) - 1, 0)
+            last = (
+                len(offsets)
+                if end_sample is None
+                else bisect_left(starts, end_sample + delay)
+            )
+            with open(target, "wb") as out:
+                out.write(tag)
+                if first < len(offsets) and first < last:
+                    end = offsets[last] if last < len(offsets) else None
+                    _copy_range(fp, out, offsets[first], end)
+            actual_starts.append(starts[first] - delay if offsets else 0)
+    return actual_starts
+
+
+def cut_mp3(source: Path, target: Path, start_seconds=None, start_sample=None, delay=0):
+    """Copies the mp3 frames from the one holding the cut point to the end."""
+    if start_sample is None:
+        start_sample = int(round(start_seconds * mp3_sampling_rate(source)))
+    return split_mp3(source, [(target, start_sample, None)], delay)[0]
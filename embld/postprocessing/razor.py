@@ -1,6 +1,51 @@
 from abc import ABCMeta, abstractmethod
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
+
+from embld.postprocessing.io import (
+    read_sync_sidecar,
+    segment_file_name,
+    write_cut_sync_sidecar,
+)
+from embld.postprocessing.manifest import RazorManifest
+
+_AUDIO_BLOCK_FRAMES = 1 << 16
+
+
+def _audio_sampling_rate(file: Path) -> int:
+    if file.suffix == ".flac":
+        import soundfile
+
+        return soundfile.info(str(file)).samplerate
+    import wave
+
+    with wave.open(str(file), "rb") as source:
+        return source.getframerate()
+
+
+def _start_sample(segment_timings, segment_indices, sampling_rate):
+    if segment_indices:
+        return int(segment_indices[0])
+    return int(round(segment_timings[0] * sampling_rate))
+
+
+def _boundaries(segment_timings, segment_indices, sampling_rate):
+    if segment_indices:
+        return [int(index) for index in segment_indices]
+    return [int(round(onset * sampling_rate)) for onset in segment_timings]
+
+
+def _segment_ranges(segment_timings, segment_indices, sampling_rate):
+    """(start, end) sample of every segment between two consecutive syncs."""
+    boundaries = _boundaries(segment_timings, segment_indices, sampling_rate)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _segment_targets(file, target_directory, ranges):
+    return [
+        (target_directory / segment_file_name(file, position), start, end)
+        for position, (start, end) in enumerate(ranges)
+    ]
 
 
 class RecordingRazor(metaclass=ABCMeta):
@@ -9,8 +54,23 @@ class RecordingRazor(metaclass=ABCMeta):
 
     @abstractmethod
     def __call__(
-        self, file: Path, target_directory: Path, segment_timings: list[float]
+        self,
+        file: Path,
+        target_directory: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
+    ) -> Any:
+        pass
+
+    @abstractmethod
+    def split(
+        self,
+        file: Path,
+        target_directory: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
     ) -> Any:
+        """Writes one file per segment between consecutive syncs, reading the input once."""
         pass
 
     @abstractmethod
@@ -19,16 +79,64 @@ class RecordingRazor(metaclass=ABCMeta):
 
 
 class DispatchingRazor(RecordingRazor):
-    def __init__(self) -> None:
+    def __init__(
+        self, manifest: Optional[RazorManifest] = None, split: bool = False
+    ) -> None:
         super().__init__()
         self.razors = []
+        self.manifest = manifest
+        self.split_segments = split
 
     def __call__(
-        self, file: Path, target_directory: Path, segment_timings: list[float]
+        self,
+        file: Path,
+        target_directory: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
+    ) -> Any:
+        return self._dispatch(
+            file,
+            target_directory,
+            segment_timings,
+            segment_indices,
+            self.split_segments,
+        )
+
+    def split(
+        self,
+        file: Path,
+        target_directory: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
     ) -> Any:
+        return self._dispatch(
+            file, target_directory, segment_timings, segment_indices, True
+        )
+
+    def _dispatch(
+        self, file, target_directory, segment_timings, segment_indices, split
+    ):
+        if segment_indices is None:
+            sync = read_sync_sidecar(file)
+            if sync is not None:
+                segment_indices = sync["segment_sample_indices"]
+        key = str(file)
+        output = target_directory / (segment_file_name(file, 0) if split else file.name)
+        if self.manifest is not None and self.manifest.is_up_to_date(
+            key, file, segment_timings, segment_indices, output
+        ):
+            return False
         for razor in self.razors:
             if file.suffix[1:] in razor.handles_formats():
-                razor(file, target_directory, segment_timings)
+                if split:
+                    razor.split(
+                        file, target_directory, segment_timings, segment_indices
+                    )
+                else:
+                    razor(file, target_directory, segment_timings, segment_indices)
+        if self.manifest is not None:
+            self.manifest.record_cut(key, file, segment_timings, segment_indices)
+        return True
 
     def handles_formats(self) -> list[str]:
         return [razor.handles_formats() for razor in self.razors]
@@ -38,21 +146,72 @@ class DispatchingRazor(RecordingRazor):
 
 
 class MocapRecordingRazor(RecordingRazor):
-    def __init__(self) -> None:
+    """Cuts c3d recordings, streaming the kept frames from a memory map.
+
+    Files whose layout cannot be patched in place (non-Intel, frame count
+    overflow) and ``streaming=False`` go through a full ezc3d load instead.
+    """
+
+    def __init__(self, streaming: bool = True) -> None:
         super().__init__()
+        self.streaming = streaming
 
     def __call__(
-        self, file: Path, target_directory: Path, segment_timings: list[float]
+        self,
+        file: Path,
+        target_directory: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
     ) -> Any:
+        if self.streaming:
+            from embld.postprocessing.c3d import c3d_sampling_rate, cut_c3d
+
+            try:
+                start = _start_sample(
+                    segment_timings, segment_indices, c3d_sampling_rate(file)
+                )
+                cut_c3d(file, target_directory / file.name, start)
+                return
+            except ValueError:
+                pass
+
         import ezc3d
 
-        c3d = ezc3d.c3d(file)
+        c3d = ezc3d.c3d(str(file))
         sampling_rate = c3d["parameters"]["POINT"]["RATE"]["value"][0]
-        c3d["data"]["points"] = c3d["data"]["points"][
-            :, :, segment_timings[0] * sampling_rate :
-        ]
+        start = _start_sample(segment_timings, segment_indices, sampling_rate)
+        c3d["data"]["points"] = c3d["data"]["points"][:, :, start:]
         c3d.write(str(target_directory / file.name))
 
+    def split(
+        self,
+        file: Path,
+        target_directory: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
+    ) -> Any:
+        if self.streaming:
+            from embld.postprocessing.c3d import c3d_sampling_rate, split_c3d
+
+            try:
+                ranges = _segment_ranges(
+                    segment_timings, segment_indices, c3d_sampling_rate(file)
+                )
+                split_c3d(file, _segment_targets(file, target_directory, ranges))
+                return
+            except ValueError:
+                pass
+
+        import ezc3d
+
+        c3d = ezc3d.c3d(str(file))
+        sampling_rate = c3d["parameters"]["POINT"]["RATE"]["value"][0]
+        points = c3d["data"]["points"]
+        ranges = _segment_ranges(segment_timings, segment_indices, sampling_rate)
+        for target, start, end in _segment_targets(file, target_directory, ranges):
+            c3d["data"]["points"] = points[:, :, start:end]
+            c3d.write(str(target))
+
     def handles_formats(self) -> list[str]:
         return ["c3d"]
 
@@ -62,40 +221,225 @@ class FNIRSRecordingRazor(RecordingRazor):
         super().__init__()
 
     def __call__(
-        self, file: Path, target_directory: Path, segment_timings: list[float]
+        self,
+        file: Path,
+        target_directory: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
     ) -> Any:
         import mne
 
         raw = mne.io.read_raw_fif(file, preload=True)
-        raw.crop(tmin=segment_timings[0])
+        if segment_indices:
+            raw.crop(tmin=raw.times[min(segment_indices[0], len(raw.times) - 1)])
+        else:
+            raw.crop(tmin=segment_timings[0])
         raw.save(target_directory / file.name, overwrite=True)
 
+    def split(
+        self,
+        file: Path,
+        target_directory: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
+    ) -> Any:
+        import mne
+
+        raw = mne.io.read_raw_fif(file, preload=True)
+        ranges = _segment_ranges(segment_timings, segment_indices, raw.info["sfreq"])
+        for target, start, end in _segment_targets(file, target_directory, ranges):
+            last = len(raw.times) - 1
+            segment = raw.copy().crop(
+                tmin=raw.times[min(start, last)],
+                tmax=raw.times[min(end, last)],
+                include_tmax=False,
+            )
+            segment.save(target, overwrite=True)
+
     def handles_formats(self) -> list[str]:
         return ["fif"]
 
 
+def _split_wav(file: Path, ranges) -> None:
+    import wave
+
+    with wave.open(str(file), "rb") as source:
+        frame_size = source.getsampwidth() * source.getnchannels()
+        for target, start, end in ranges:
+            with wave.open(str(target), "wb") as out:
+                out.setparams(source.getparams())
+                source.setpos(min(start, source.getnframes()))
+                left = source.getnframes() - source.tell()
+                if end is not None:
+                    left = min(left, end - source.tell())
+                while left > 0:
+                    frames = source.readframes(min(left, _AUDIO_BLOCK_FRAMES))
+                    if not frames:
+                        break
+                    out.writeframesraw(frames)
+                    left -= len(frames) // frame_size
+
+
+def _split_flac(file: Path, ranges) -> None:
+    import soundfile
+
+    with soundfile.SoundFile(str(file)) as source:
+        for target, start, end in ranges:
+            source.seek(min(start, source.frames))
+            frames = -1 if end is None else max(end - source.tell(), 0)
+            with soundfile.SoundFile(
+                str(target),
+                "w",
+                samplerate=source.samplerate,
+                channels=source.channels,
+                subtype=source.subtype,
+                format="FLAC",
+            ) as out:
+                for block in source.blocks(
+                    blocksize=_AUDIO_BLOCK_FRAMES, frames=frames, dtype="int32"
+                ):
+                    out.write(block)
+
+
 class SoundRecordingRazor(RecordingRazor):
-    def __init__(self) -> None:
+    """Cuts audio recordings without re-encoding them.
+
+    mp3 files are cut on frame boundaries by copying the compressed frames,
+    wav and flac files are cut on the exact sample. ``reencode=True`` restores
+    the previous behaviour of decoding with pydub and exporting again. Every
+    output gets a sync sidecar with the source sample it actually starts at.
+    """
+
+    def __init__(self, reencode: bool = False) -> None:
         super().__init__()
+        self.reencode = reencode
 
     def __call__(
-        self, file: Path, target_directory: Path, segment_timings: list[float]
+        self,
+        file: Path,
+        target_directory: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
     ) -> Any:
+        extension = file.suffix[1:]
+        target = target_directory / file.name
+        if self.reencode:
+            self._reencode(file, target, segment_timings, segment_indices)
+            return
+        sampling_rate = self._sampling_rate(file)
+        start = _start_sample(segment_timings, segment_indices, sampling_rate)
+        ((actual_start, delay),) = self._copy_ranges(file, [(target, start, None)])
+        write_cut_sync_sidecar(
+            target,
+            sampling_rate,
+            actual_start,
+            delay,
+            _boundaries(segment_timings, segment_indices, sampling_rate),
+        )
+
+    def split(
+        self,
+        file: Path,
+        target_directory: Path,
+        segment_timings: list[float],
+        segment_indices: Optional[list[int]] = None,
+    ) -> Any:
+        if self.reencode:
+            import pydub
+
+            segment = pydub.AudioSegment.from_file(file, file.suffix[1:])
+            sampling_rate = segment.frame_rate
+        else:
+            sampling_rate = self._sampling_rate(file)
+        ranges = _segment_ranges(segment_timings, segment_indices, sampling_rate)
+        targets = _segment_targets(file, target_directory, ranges)
+        if not self.reencode:
+            cuts = self._copy_ranges(file, targets)
+        else:
+            cuts = []
+            for target, start, end in targets:
+                self._export(
+                    file,
+                    segment.get_sample_slice(start_sample=start, end_sample=end),
+                    target,
+                )
+                cuts.append((start, self._output_delay(target)))
+        for (target, start, end), (actual_start, delay) in zip(targets, cuts):
+            write_cut_sync_sidecar(
+                target, sampling_rate, actual_start, delay, [start, end]
+            )
+
+    @staticmethod
+    def _sampling_rate(file):
+        if file.suffix == ".mp3":
+            from embld.postprocessing.mp3 import mp3_sampling_rate
+
+            return mp3_sampling_rate(file)
+        return _audio_sampling_rate(file)
+
+    @staticmethod
+    def _output_delay(target):
+        if target.suffix == ".mp3":
+            from embld.postprocessing.mp3 import encoder_delay
+
+            return encoder_delay(target)
+        return 0
+
+    @staticmethod
+    def _copy_ranges(file, ranges):
+        """Cuts every range, returns the source sample each output actually
+        starts at and the samples a decoder outputs before it."""
+        if file.suffix == ".mp3":
+            from embld.postprocessing.mp3 import DECODER_DELAY, encoder_delay, split_mp3
+
+            # Frames are located on the decoded timeline, which starts with the
+            # samples the encoder prepended to the recorded ones
+            sync = read_sync_sidecar(file)
+            delay = None if sync is None else sync.get("encoder_delay")
+            if delay is None:
+                delay = encoder_delay(file)
+            actual_starts = split_mp3(file, ranges, delay)
+            # The copied frames carry no LAME tag, only the decoder delay is added
+            return [(start, DECODER_DELAY) for start in actual_starts]
+        if file.suffix == ".flac":
+            _split_flac(file, ranges)
+        else:
+            _split_wav(file, ranges)
+        return [(start, 0) for _, start, _ in ranges]
+
+    def _reencode(self, file, target, segment_timings, segment_indices):
         import pydub
 
         extension = file.suffix[1:]
 
         segment = pydub.AudioSegment.from_file(file, extension)
-        segment = segment[
-            segment_timings[0] * 1000 :
-        ]  # segments are indexed in milliseconds
+        sampling_rate = segment.frame_rate
+        start = _start_sample(segment_timings, segment_indices, sampling_rate)
+        if segment_indices:
+            segment = segment.get_sample_slice(start_sample=segment_indices[0])
+        else:
+            segment = segment[
+                segment_timings[0] * 1000 :
+            ]  # segments are indexed in milliseconds
+        self._export(file, segment, target)
+        write_cut_sync_sidecar(
+            target,
+            sampling_rate,
+            start,
+            self._output_delay(target),
+            _boundaries(segment_timings, segment_indices, sampling_rate),
+        )
+
+    @staticmethod
+    def _export(file, segment, target):
+        import pydub
+
+        extension = file.suffix[1:]
         if "mp3" in extension:
             info = pydub.utils.mediainfo(file)
-            segment.export(
-                target_directory / file.name, format="mp3", bitrate=info["bit_rate"]
-            )
+            segment.export(target, format="mp3", bitrate=info["bit_rate"])
         else:
-            segment.export(target_directory / file.name, format=extension)
+            segment.export(target, format=extension)
 
     def handles_formats(self) -> list[str]:
-        return ["wav", "mp3"]
+        return ["wav", "mp3", "flac"]
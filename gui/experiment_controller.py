@@ -4,6 +4,7 @@ from embld.acquisition.audio_recorder import AudioRecorder
 
 from embld.acquisition.metadata_recorder import MetadataRecorder
 from embld.acquisition.qtm_recorder import QTMMocapRecorder
+from embld.acquisition.storage import create_output_backend
 from embld.configuration import APP_PARAMETERS
 from embld.experiment.experiment_driver import EMBLDAcquisitionDriver
 from gui.dashboard_view import DashboardView
@@ -19,11 +20,13 @@ class ExperimentGUIController:
     def __init__(self, view: DashboardView):
         super().__init__()
         self.driver = None
+        self.output_backend = None
         self.view = view
         self.view.connect_start_simulation(self.start_simulation)
         self.view.connect_next(self.next_step)
         self.view.connect_sync(self.send_sync_event)
         self.time = 0.0
+        self.displayed_time = None
 
     def start_simulation(self):
         error = not self.view.check_subject_form_validity()
@@ -42,11 +45,25 @@ class ExperimentGUIController:
             Path(base_output_path).mkdir(exist_ok=True)
 
             trial_segments = APP_PARAMETERS["trial_segments"]
+            self.output_backend = create_output_backend(
+                APP_PARAMETERS, metadata, base_output_path
+            )
+            spool_fsync_interval = APP_PARAMETERS.get("spool_fsync_interval")
 
             logger.info("Registering recorders...")
             recorders = {
-                "metadata": MetadataRecorder(metadata, trial_segments=trial_segments),
-                "audio": AudioRecorder(metadata, trial_segments=trial_segments),
+                "metadata": MetadataRecorder(
+                    metadata,
+                    trial_segments=trial_segments,
+                    output_backend=self.output_backend,
+                    spool_fsync_interval=spool_fsync_interval,
+                ),
+                "audio": AudioRecorder(
+                    metadata,
+                    trial_segments=trial_segments,
+                    output_backend=self.output_backend,
+                    spool_fsync_interval=spool_fsync_interval,
+                ),
                 # "metadata2": MetadataRecorder(metadata, trial_segments=trial_segments, inst=2),
                 # 'fnirs': ArtinisFNIRSRecorder(metadata, trial_segments=trial_segments)
             }
@@ -56,6 +73,8 @@ class ExperimentGUIController:
                     metadata,
                     trial_segments=trial_segments,
                     sampling_rate=APP_PARAMETERS["sampling_rate"],
+                    output_backend=self.output_backend,
+                    spool_fsync_interval=spool_fsync_interval,
                 )
 
             logger.debug("Generating configurations...")
@@ -83,11 +102,20 @@ class ExperimentGUIController:
             #     print(e)
             #     exit(-1)
 
+    def close(self):
+        if self.driver is not None:
+            self.driver.close()
+        if self.output_backend is not None:
+            self.output_backend.close()
+
     def set_timer(self, now):
         time = now_absolute() - self.time
         seconds, ms = divmod(time, 1000)
         minutes, seconds = divmod(seconds, 60)
-        self.view.update_time(f"{minutes:02.0f}'{seconds:02.0f}''")
+        displayed_time = f"{minutes:02.0f}'{seconds:02.0f}''"
+        if displayed_time != self.displayed_time:
+            self.displayed_time = displayed_time
+            self.view.update_time(displayed_time)
 
     def ui_ready_for_next(self):
         self.view.set_ready_for_next()
@@ -4,6 +4,7 @@ import sys
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QApplication
 
+from embld.acquisition.writer_pool import shutdown_writer_pool
 from gui.dashboard_view import DashboardView
 from gui.experiment_controller import ExperimentGUIController
 from util.logging import setup_logging
@@ -27,4 +28,7 @@ if __name__ == "__main__":
     win = DashboardView()
     controller = ExperimentGUIController(win)
     win.show()
-    sys.exit(app.exec())
+    exit_code = app.exec()
+    shutdown_writer_pool()
+    controller.close()
+    sys.exit(exit_code)
@@ -1,7 +1,7 @@
 import logging
 import time
 
-from PyQt5.QtCore import QThread, pyqtSignal, QMutex
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal
 
 logger = logging.getLogger()
 
@@ -14,27 +14,38 @@ def now_absolute():
     return time.monotonic_ns() / 1000000.0
 
 
-class TimerEventThread(QThread):
+class ProtocolClock(QObject):
+    """Protocol time for the experiment, pushed to the UI at a low rate.
+
+    ``now`` is a plain clock read and can be called from any thread. The UI
+    signal is driven by a ``QTimer`` in the thread that created the clock, at
+    ``ui_rate`` Hz, which is plenty for a label that displays seconds.
+    """
+
     __protocol_timer = pyqtSignal(float)
 
-    def __init__(self) -> None:
+    def __init__(self, ui_rate=20) -> None:
         super().__init__()
-        logger.info("Initializing time thread...")
-        self._mutex = QMutex()
-        self._start = 0
+        logger.info("Initializing protocol clock...")
+        self._start = now_absolute()
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.CoarseTimer)
+        self._timer.setInterval(max(1, int(1000 / ui_rate)))
+        self._timer.timeout.connect(self._tick)
+
+    def start(self):
+        logger.info("Starting clock...")
+        self._start = now_absolute()
+        self._timer.start()
 
-    def run(self):
-        logger.info("Starting Timer...")
-        self._start = time.monotonic_ns() / 1000000.0
-        while True:
-            self.msleep(1)
-            now = self.now()
-            self.__protocol_timer.emit(float(now))
+    def exit(self):
+        self._timer.stop()
 
-        self.exec_()
+    def _tick(self):
+        self.__protocol_timer.emit(float(self.now()))
 
     def now(self):
-        return time.monotonic_ns() / 1000000.0 - self._start
+        return now_absolute() - self._start
 
     def start_time(self):
         return self._start
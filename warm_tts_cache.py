@@ -0,0 +1,62 @@
+import argparse
+import itertools
+
+from tqdm import tqdm
+
+from embld.configuration import APP_PARAMETERS
+from embld.experiment.action_parser import pending_action_variant
+from embld.experiment.configuration_space import ConfigurationSpace
+from embld.experiment.tts_cache import create_tts_cache
+
+parser = argparse.ArgumentParser(
+    description="Synthesize the instruction sounds of every generated configuration ahead of an acquisition session"
+)
+parser.add_argument(
+    "--synthesizer",
+    type=str,
+    default=None,
+    help="Synthesizer backend (gtts or pyttsx3 for offline synthesis), defaults to the one in config.json",
+)
+
+parser.add_argument(
+    "--jobs",
+    type=int,
+    default=None,
+    help="Number of concurrent syntheses, defaults to the one in config.json",
+)
+
+
+def every_instruction(space):
+    """Instructions of every configuration of ``space``, for every value of
+    their rand(a,b) parameters since any of them may be drawn in a session."""
+    instructions = set()
+    for action_index, variant in zip(*space.layout()):
+        pending = pending_action_variant(space.actions[action_index], int(variant))
+        ranges = [range(low, high + 1) for low, high in pending.rands.values()]
+        for rand_values in itertools.product(*ranges):
+            instructions.add(pending.render(list(rand_values))["instruction"])
+    return instructions
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    cache = create_tts_cache(
+        APP_PARAMETERS, synthesizer=args.synthesizer, max_workers=args.jobs
+    )
+
+    instructions = every_instruction(
+        ConfigurationSpace.from_actions(APP_PARAMETERS["actions"])
+    )
+    missing = [
+        instruction for instruction in instructions if cache.get(instruction) is None
+    ]
+    print(f"{len(instructions)} instructions, {len(missing)} not cached yet")
+
+    futures = {instruction: cache.request(instruction) for instruction in missing}
+    failed = 0
+    for instruction, future in tqdm(futures.items(), desc="Synthesizing"):
+        if future.exception() is not None:
+            failed += 1
+            tqdm.write(f"Could not synthesize '{instruction}': {future.exception()}")
+    cache.shutdown()
+    print(f"{len(missing) - failed}/{len(missing)} instruction sounds synthesized")